@@ -1,48 +1,245 @@
 import matplotlib.pyplot as plt
 from matplotlib.collections import LineCollection
-from scipy.sparse import csr_matrix
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from scipy.sparse import csr_matrix, coo_matrix
 import numpy as np
-from scipy.sparse.csgraph import shortest_path
+from scipy.sparse.csgraph import shortest_path, dijkstra, connected_components
 import time
+import itertools
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from scipy.spatial import cKDTree
+from instrumentation import stage
+import instrumentation
 """ Assignment 1
 Author: Anton Sandberg (2021) and Oliver Johansson (2021), 
     antsandb@student.chalmers.se and olijoh@student.chalmers.se """
 
+FILENAMES = ['SampleCoordinates.txt', 'HungaryCities.txt', 'GermanyCities.txt']
+START_NODES = [0, 311, 1573]
+END_NODES = [5, 702, 10584]
+RADIUS = [0.08, 0.005, 0.0025]  # All given in the assignment
 
-def read_coordinate_file(filename):
-    """ Reads the given coordinate file and parses the results into an array of coordinates
+# Limit of the first search of find_route relative to the straight line distance, and its growth per retry
+ROUTE_SLACK = 1.2
+ROUTE_GROWTH = 1.5
+# Number of landmarks whose lower bounds find_route_alt uses per query, and its first limit relative to the
+# landmark lower bound of the distance
+ALT_ACTIVE_LANDMARKS = 6
+ALT_SLACK = 1.1
+
+# Suffix of the binary sidecar that caches the projected coordinates of a coordinate file
+COORDINATE_CACHE_SUFFIX = '.coords.npy'
+# Version of the parsing and projection stored in the cache key, bump it when mercator_projection or the
+# sidecar format changes so the old sidecars are rebuilt
+COORDINATE_CACHE_VERSION = 1
+
+
+def mercator_projection(latlon, r=1):
+    """ Projects latitude/longitude pairs to the plane with the Mercator projection
+
+    :param latlon: Latitudes in the first column and longitudes in the second
+    :param r: Radius of the sphere
+    :type latlon: ndarray
+    :type r: float
+
+    :return coords: The projected (x, y) coordinates
+    :rtype coords: ndarray
+    """
+
+    latlon = np.asarray(latlon, dtype=np.float64).reshape(-1, 2)
+    coords = np.empty_like(latlon)
+    # Same expressions as the given instructions, applied to whole columns at once
+    coords[:, 0] = r*np.pi*latlon[:, 1]/180
+    coords[:, 1] = r*np.log(np.tan(np.pi/4 + np.pi*latlon[:, 0]/360))
+
+    return coords
+
+
+# Braces and commas are turned into whitespace before parsing
+_COORDINATE_SEPARATORS = str.maketrans('{},', '   ')
+
+
+def _parse_coordinate_text(text):
+    """ Parses a block of "{lat, lon}" lines into a (n, 2) float64 array of latitudes and longitudes
+
+    :param text: One or more lines of the coordinate file
+    :type text: str
+
+    :return latlon: The parsed latitudes and longitudes
+    :rtype latlon: ndarray
+
+    :raises ValueError: if a line doesn't hold exactly two values
+    """
+
+    separated = text.translate(_COORDINATE_SEPARATORS)
+
+    # Every value starts after whitespace, so counting the starts per line finds a line with a missing or an
+    # extra value, which would otherwise shift every following row
+    chars = np.frombuffer(separated.encode(), dtype=np.uint8)
+    space = chars <= ord(' ')
+    starts = np.flatnonzero(~space & np.concatenate(([True], space[:-1])))
+    per_line = np.bincount(np.searchsorted(np.flatnonzero(chars == ord('\n')), starts))
+    bad = np.flatnonzero((per_line != 0) & (per_line != 2))
+    if len(bad):
+        raise ValueError("Expected a latitude and a longitude on the line: {!r}".format(text.split('\n')[bad[0]]))
+    if not len(starts):
+        # np.fromstring reads a blank text as one value
+        return np.empty((0, 2))
+
+    values = np.fromstring(separated, dtype=np.float64, sep=' ')
+    if len(values) != len(starts):
+        raise ValueError("Only {} of the {} values could be parsed".format(len(values), len(starts)))
+    return values.reshape(-1, 2)
+
+
+def read_coordinate_chunks(filename, chunk_lines=1000000):
+    """ Reads the given coordinate file in chunks so files larger than the memory can be streamed
 
     :param filename: File with coordinates
+    :param chunk_lines: Number of lines parsed per chunk
     :type filename: txt
+    :type chunk_lines: int
 
-    :return coords: returns the coordinates in an array format
+    :return coords: yields the projected coordinates of each chunk
     :rtype coords: ndarray
     """
 
-    start = time.time()
-    r = 1
-    # Pre creating the list
-    coords = []
-
     with open(filename) as f:
-        for line in f:
-            line = line.replace('{', '')
-            line = line.replace('}', '')
-            line = line.strip().split(',')
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if not lines:
+                break
+            yield mercator_projection(_parse_coordinate_text(''.join(lines)))
+
+
+def _file_digest(filename):
+    """ Computes the content hash used to validate the coordinate cache
+
+    :param filename: File to hash
+    :type filename: txt
+
+    :return digest: Hex digest of the file contents
+    :rtype digest: str
+    """
+
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_coordinate_cache(filename):
+    """ Memory-maps the cached coordinates of filename if the sidecar is still valid
+
+    The cache is trusted directly when the size and mtime of the source file match, if only the
+    mtime differs the content hash decides and the key is refreshed.
+
+    :param filename: File with coordinates
+    :type filename: txt
+
+    :return coords: The cached coordinates or None if the cache is missing or stale
+    :rtype coords: ndarray
+    """
+
+    cache_file = filename + COORDINATE_CACHE_SUFFIX
+    key_file = cache_file + '.json'
+    try:
+        with open(key_file) as f:
+            key = json.load(f)
+        stat = os.stat(filename)
+        if key.get('version') != COORDINATE_CACHE_VERSION or key['size'] != stat.st_size:
+            return None
+        if key['mtime_ns'] != stat.st_mtime_ns:
+            if key['sha1'] != _file_digest(filename):
+                return None
+            key['mtime_ns'] = stat.st_mtime_ns
+            _write_atomic(key_file, lambda f: f.write(json.dumps(key).encode()))
+        return np.load(cache_file, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_coordinate_cache(filename, coords):
+    """ Writes coords to the binary sidecar of filename together with its cache key
+
+    :param filename: File with coordinates
+    :param coords: The parsed coordinates
+    :type filename: txt
+    :type coords: ndarray
+    """
 
-            x = r*np.pi*float(line[1])/180  # Changing the variables from given instructions
-            y = r*np.log(np.tan(np.pi/4 + np.pi*float(line[0])/360))
+    cache_file = filename + COORDINATE_CACHE_SUFFIX
+    stat = os.stat(filename)
+    key = {'version': COORDINATE_CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+           'sha1': _file_digest(filename)}
+    try:
+        _write_atomic(cache_file, lambda f: np.save(f, coords))
+        _write_atomic(cache_file + '.json', lambda f: f.write(json.dumps(key).encode()))
+    except OSError:
+        pass  # A read-only directory just means no cache
 
-            coords.append((x, y))
 
-    end = time.time()
-    time1 = end - start
-    print("Time of read_coordinate_file : %.6f" % time1)
+def _write_atomic(path, write):
+    """ Writes a file through a temporary file so readers never see a half written file
 
-    return np.array(coords)
+    :param path: The file to write
+    :param write: Function that writes the content to an open binary file
+    :type path: str
+    :type write: function
+    """
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+@stage(counts=lambda coords: {'points': len(coords)})
+def read_coordinate_file(filename, chunk_lines=None, cache=True):
+    """ Reads the given coordinate file and parses the results into an array of coordinates
+
+    The projected coordinates are stored in a .npy sidecar next to the file and memory-mapped on the
+    following runs, the sidecar is rebuilt when the file or COORDINATE_CACHE_VERSION changes. The returned
+    array is read-only whether it came from the sidecar or not, copy it before changing it.
+
+    :param filename: File with coordinates
+    :param chunk_lines: If given the file is parsed this many lines at a time instead of in one pass
+    :param cache: Use and update the binary sidecar
+    :type filename: txt
+    :type chunk_lines: int
+    :type cache: bool
+
+    :return coords: returns the coordinates in an array format, read-only
+    :rtype coords: ndarray
+    """
 
+    coords = _load_coordinate_cache(filename) if cache else None
 
+    if coords is None:
+        if chunk_lines is None:
+            with open(filename) as f:
+                coords = mercator_projection(_parse_coordinate_text(f.read()))
+        else:
+            chunks = list(read_coordinate_chunks(filename, chunk_lines))
+            coords = np.concatenate(chunks) if chunks else np.empty((0, 2))
+        if cache:
+            _write_coordinate_cache(filename, coords)
+        coords.flags.writeable = False
+
+    return coords
+
+
+@stage()
 def plot_points(coord_list, indices, path):
     """ Plots the data points read from the file
 
@@ -55,37 +252,149 @@ def plot_points(coord_list, indices, path):
 
     """
 
-    start = time.time()
-    x = []
-    y = []  # Pre creating the lists
-
-    for i in coord_list:
-        x.append(i[0])
-        y.append(i[1])  # Separating x and y coordinates
-
     lines = LineCollection(coord_list[indices], linewidths=0.2, colors='grey')
     fig, ax = plt.subplots()
     ax.add_collection(lines)
-    ax.scatter(x, y, s=7, c='r')
+    ax.scatter(coord_list[:, 0], coord_list[:, 1], s=7, c='r')
 
-    x_path = []
-    y_path = []
+    ax.plot(coord_list[path, 0], coord_list[path, 1])
 
-    for [x_c, y_c] in coord_list[path]:
-        x_path.append(x_c)
-        y_path.append(y_c)
+    plt.title("Shortest Path")
 
-    ax.plot(x_path, y_path)
+    plt.show()
 
-    end = time.time()
-    time2 = end - start
-    print("Time of plt_points  : %.7f" % time2)
 
-    plt.title("Shortest Path")
+@stage(counts=lambda indices: {'edges': len(indices)})
+def decimate_edges(coord_list, indices, max_edges, grid=256):
+    """ Picks at most max_edges of the edges so that every part of the map keeps some of its edges
 
-    plt.show()
+    The edges are put in a grid x grid raster by their midpoint and the same number of edges is kept
+    from every cell, so the dense cells are thinned out and the sparse ones are kept as they are.
+    Edges stored in both directions are only drawn once.
 
+    :param coord_list: The coordinates for all cities
+    :param indices: The pairs that are in range
+    :param max_edges: Largest number of edges to keep
+    :param grid: Number of cells along each axis
+    :type coord_list: ndarray
+    :type indices: ndarray
+    :type max_edges: int
+    :type grid: int
+
+    :return indices: The kept pairs
+    :rtype indices: ndarray
+    """
+
+    indices = indices[indices[:, 0] < indices[:, 1]] if np.any(indices[:, 0] > indices[:, 1]) else indices
+    if len(indices) <= max_edges:
+        return indices
+
+    middle = (coord_list[indices[:, 0]] + coord_list[indices[:, 1]]) / 2
+    low, high = middle.min(axis=0), middle.max(axis=0)
+    cell_xy = np.minimum(((middle - low) / np.maximum(high - low, 1e-300) * grid).astype(np.intp), grid - 1)
+    cell = cell_xy[:, 0] * grid + cell_xy[:, 1]
+
+    order = np.argsort(cell, kind='stable')
+    cells, first, counts = np.unique(cell[order], return_index=True, return_counts=True)
+    rank = np.arange(len(order)) - np.repeat(first, counts)
+
+    # Largest number of edges per cell that keeps the total within max_edges. kept[i] is the total with the
+    # cap at the i-th smallest count, the room left above the largest such count is shared by the cells
+    # that have more edges than it
+    sorted_counts = np.sort(counts)
+    kept = np.cumsum(sorted_counts) + sorted_counts * np.arange(len(sorted_counts) - 1, -1, -1)
+    if kept[0] <= max_edges:
+        i = np.searchsorted(kept, max_edges, side='right') - 1
+        larger = len(sorted_counts) - np.searchsorted(sorted_counts, sorted_counts[i], side='right')
+        cap = int(sorted_counts[i] + (max_edges - kept[i]) // larger)
+    else:
+        cap = max(max_edges // len(counts), 1)
+    keep = np.sort(order[rank < cap])
+
+    # With more occupied cells than max_edges every cell keeps one edge and those are thinned out evenly
+    if len(keep) > max_edges:
+        keep = keep[np.linspace(0, len(keep) - 1, max_edges).astype(np.intp)]
+
+    return indices[keep]
+
+
+@stage()
+def render_points(coord_list, indices, path, filename, max_edges=100000, dpi=150):
+    """ Draws the cities, the connections and the path straight to an image file without a display
+
+    The figure is drawn with the Agg backend and the format follows the file extension (e.g. .png or .svg).
+    Graphs with more than max_edges edges are thinned out with decimate_edges and the edges are rasterized
+    in vector formats.
+
+    :param coord_list: The coordinates for all cities
+    :param indices: The pairs that are in range
+    :param path: shortest path from start to end city
+    :param filename: Image file to write
+    :param max_edges: Largest number of edges to draw
+    :param dpi: Resolution of the image
+    :type coord_list: ndarray
+    :type indices: ndarray
+    :type path: ndarray
+    :type filename: str
+    :type max_edges: int
+    :type dpi: int
+
+    :return times: Time in seconds of each stage, "decimate", "draw" and "save"
+    :rtype times: dict
+    """
 
+    times = {}
+
+    start = time.perf_counter()
+    indices = decimate_edges(coord_list, indices, max_edges)
+    times['decimate'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.add_collection(LineCollection(coord_list[indices], linewidths=0.2, colors='grey', rasterized=True))
+    ax.scatter(coord_list[:, 0], coord_list[:, 1], s=1 if len(coord_list) > 10000 else 7, c='r',
+               linewidths=0, rasterized=True)
+    ax.plot(coord_list[path, 0], coord_list[path, 1])
+    ax.autoscale_view()
+    ax.set_title("Shortest Path")
+    times['draw'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fig.savefig(filename, dpi=dpi)
+    times['save'] = time.perf_counter() - start
+
+    return times
+
+
+def _edge_count(result):
+    """ Item counts of the construct_*_connections stages
+
+    :param result: The pairs and distances
+    :type result: tuple
+
+    :return counts: The number of edges
+    :rtype counts: dict
+    """
+
+    return {'edges': len(result[0])}
+
+
+def _graph_counts(matrix):
+    """ Item counts of the construct_*graph stages
+
+    :param matrix: The graph
+    :type matrix: csr_matrix
+
+    :return counts: The number of cities and stored edges
+    :rtype counts: dict
+    """
+
+    return {'points': matrix.shape[0], 'edges': matrix.nnz}
+
+
+@stage(counts=_edge_count)
 def construct_graph_connections(coord_list, radius):
     """ Computes all the connections between all the points
     in coord_list that are within the radius given
@@ -101,7 +410,6 @@ def construct_graph_connections(coord_list, radius):
     :rtype distances: ndarray
     """
 
-    start = time.time()
     # Pre create the lists
     links = []
     distances = []
@@ -115,21 +423,24 @@ def construct_graph_connections(coord_list, radius):
 
                 distances.append(dist)
 
-    end = time.time()
-    time3 = end - start
-    print("Time of construct_graph_connections  : %.3f" % time3)
-
     return np.array(links), np.array(distances)
 
 
-def construct_fast_graph_connections(coord_list, radius):
-    """ Computes all the connections between all the points
-    in coord_list that are within the radius given but faster
+@stage(counts=_edge_count)
+def construct_blocked_graph_connections(coord_list, radius, block_mb=64):
+    """ Computes all the connections between all the points in coord_list that are within the radius
+    given by comparing every pair exactly, tile by tile
+
+    The points are sorted on x and the distances are computed with NumPy for square tiles of the distance
+    matrix whose temporaries fit in block_mb megabytes. Only the tiles on and above the diagonal that are
+    within radius in x are computed. The result is the same as from construct_fast_graph_connections.
 
     :param coord_list: the coordinate list for respective city
     :param radius: The radius which will be checked
+    :param block_mb: Memory used for the working set of one tile in MB
     :type coord_list: ndarray
     :type radius: float
+    :type block_mb: float
 
     :return links: Every pair that's within range
     :return distances: All the pair's distance
@@ -137,71 +448,543 @@ def construct_fast_graph_connections(coord_list, radius):
     :rtype distances: ndarray
     """
 
-    start = time.time()
-    # Pre create the lists
-    distances = []
-    pairs = []
+    N = len(coord_list)
+    # Four float64 temporaries of size block x block are alive at the same time
+    block = max(1, int(np.sqrt(block_mb * 2**20 / (4 * 8))))
+    # Sorting on x lets the tiles that are further apart than radius in x be skipped
+    order = np.argsort(coord_list[:, 0], kind='stable')
+    x = np.ascontiguousarray(coord_list[order, 0], dtype=np.float64)
+    y = np.ascontiguousarray(coord_list[order, 1], dtype=np.float64)
+    r2 = radius**2
+    found = []
+
+    for i0 in range(0, N, block):
+        i1 = min(i0 + block, N)
+        for j0 in range(i0, N, block):
+            if x[j0] - x[i1 - 1] > radius:
+                break
+            j1 = min(j0 + block, N)
+            dx = x[i0:i1, None] - x[None, j0:j1]
+            dy = y[i0:i1, None] - y[None, j0:j1]
+            near = dx*dx + dy*dy <= r2
+            if i0 == j0:
+                near = np.triu(near, 1)  # Only i < j on the diagonal tiles
+            i, j = np.nonzero(near)
+            i, j = order[i + i0], order[j + j0]
+            found.append(np.column_stack((np.minimum(i, j), np.maximum(i, j))))
+
+    pairs = np.concatenate(found) if found else np.empty((0, 2), dtype=np.intp)
+    links, distances = _both_directions(pairs, _pair_distances(coord_list, pairs))
+
+    return links, distances
+
+
+@stage(counts=lambda result: {'points': len(result[1])})
+def snap_to_cities(tree, latlon, k=1):
+    """ Finds the k nearest cities of raw latitude/longitude positions
+
+    The positions are projected with mercator_projection like the coordinate files, and all positions are
+    looked up in the cKDTree of the cities in one call using all cores.
+
+    :param tree: cKDTree of the projected city coordinates
+    :param latlon: Latitudes in the first column and longitudes in the second
+    :param k: Number of nearest cities per position
+    :type tree: cKDTree
+    :type latlon: ndarray
+    :type k: int
+
+    :return distances: Projected distance to the nearest cities, shape (n,) for k = 1 and (n, k) otherwise
+    :return cities: The nearest cities, same shape as distances
+    :rtype distances: ndarray
+    :rtype cities: ndarray
+    """
 
-    # Uses cKDTree to cut down on time
-    tree = cKDTree(coord_list)
-    links = tree.query_ball_tree(tree, radius)
+    return tree.query(mercator_projection(latlon), k=k, workers=-1)
 
-    # After the above use the same thought process to create the pairs as well as check distance
-    for city, near_cities in enumerate(links):
-        for near_city in near_cities:
-            if city != near_city:
-                dist = np.sqrt((coord_list[city][0] - coord_list[near_city][0]) ** 2 + (coord_list[city][1] - coord_list[near_city][1]) ** 2)
-                distances.append(dist)
-                pairs.append((city, near_city))
 
-    end = time.time()
-    time4 = end - start
-    print("Time of construct_fast_graph_connections  : %.3f" % time4)
+# Number of pairs whose distances _pair_distances computes at a time
+_PAIR_BLOCK = 1 << 18
+
+
+def _pair_distances(coord_list, pairs, dtype=np.float64):
+    """ Computes the distance of every pair with NumPy, in blocks of _PAIR_BLOCK pairs so that the float64 and
+    index temporaries stay small next to the result
+
+    :param coord_list: the coordinate list for respective city
+    :param pairs: (i, j) index pairs
+    :param dtype: Type of the distances, they are computed in float64 either way
+    :type coord_list: ndarray
+    :type pairs: ndarray
+    :type dtype: dtype
+
+    :return distances: The distance between the cities of every pair
+    :rtype distances: ndarray
+    """
+
+    x, y = coord_list[:, 0], coord_list[:, 1]
+    distances = np.empty(len(pairs), dtype=dtype)
+    for first in range(0, len(pairs), _PAIR_BLOCK):
+        i, j = pairs[first:first + _PAIR_BLOCK, 0], pairs[first:first + _PAIR_BLOCK, 1]
+        dx, dy = x[i] - x[j], y[i] - y[j]
+        dx *= dx
+        dy *= dy
+        dx += dy
+        np.sqrt(dx, out=distances[first:first + _PAIR_BLOCK], casting='same_kind')
+    return distances
+
 
-    return np.array(pairs), np.array(distances)
+def _both_directions(pairs, distances):
+    """ Turns pairs with i < j into the (i, j) and (j, i) pairs, sorted on i and then j
 
+    :param pairs: (i, j) index pairs with i < j
+    :param distances: The distance of every pair
+    :type pairs: ndarray
+    :type distances: ndarray
+
+    :return links: Every pair in both directions
+    :return distances: All the pair's distance
+    :rtype links: ndarray
+    :rtype distances: ndarray
+    """
 
-def construct_graph(indices, distance, N):
+    links = np.concatenate((pairs, pairs[:, ::-1]))
+    distances = np.concatenate((distances, distances))
+    order = np.lexsort((links[:, 1], links[:, 0]))
+    return links[order], distances[order]
+
+
+def _query_pairs(tree, coord_list, radius, workers=1, chunk_size=16384):
+    """ Finds the (i, j) pairs with i < j within radius, with several threads if workers isn't 1
+
+    With more than one worker the cities are sorted on y and split into bands of at most chunk_size cities,
+    at least one band per worker. Every band is searched with query_pairs in a cKDTree of the band and the
+    cities up to radius above it, which returns an array and runs without the GIL, so the threads search
+    at the same time. The pairs of the bands are put together in the order of the bands.
+
+    :param tree: cKDTree of coord_list
+    :param coord_list: the coordinate list for respective city
+    :param radius: The radius which will be checked
+    :param workers: Number of threads, all cores if -1
+    :param chunk_size: Largest number of cities per band
+    :type tree: cKDTree
+    :type coord_list: ndarray
+    :type radius: float
+    :type workers: int
+    :type chunk_size: int
+
+    :return pairs: The pairs
+    :rtype pairs: ndarray
+    """
+
+    if workers == -1:
+        workers = os.cpu_count() or 1
+    if workers == 1 or len(coord_list) == 0:
+        return tree.query_pairs(radius, output_type='ndarray')
+
+    coord_list = np.asarray(coord_list)
+    order = np.argsort(coord_list[:, 1], kind='stable')
+    y = coord_list[order, 1]
+    n_bands = min(len(order), max(workers, -(-len(order) // chunk_size)))
+    bounds = np.linspace(0, len(order), n_bands + 1).astype(np.intp)
+
+    def search(band):
+        first, last = bounds[band], bounds[band + 1]
+        # The cities above the band that can be connected to it, with a little slack for the rounding
+        stop = np.searchsorted(y, y[last - 1] + 1.000001 * radius, side='right')
+        cities = order[first:stop]
+        pairs = cKDTree(coord_list[cities]).query_pairs(radius, output_type='ndarray')
+        # Pairs with both cities above the band are found with the bands above
+        pairs = pairs[np.minimum(pairs[:, 0], pairs[:, 1]) < last - first]
+        i, j = cities[pairs[:, 0]], cities[pairs[:, 1]]
+        return np.column_stack((np.minimum(i, j), np.maximum(i, j)))
+
+    with ThreadPoolExecutor(workers) as pool:
+        bands = list(pool.map(search, range(n_bands)))
+
+    return np.concatenate(bands)
+
+
+@stage(counts=_edge_count)
+def construct_fast_graph_connections(coord_list, radius, method='pairs', compact=False, return_tree=False, workers=1):
+    """ Computes all the connections between all the points
+    in coord_list that are within the radius given but faster
+
+    With method 'pairs' or 'sparse' the pairs and distances come straight from the cKDTree as arrays,
+    ordered on the first city and then the second, 'loop' is the original per pair loop.
+
+    :param coord_list: the coordinate list for respective city
+    :param radius: The radius which will be checked
+    :param method: 'pairs' (query_pairs), 'sparse' (sparse_distance_matrix) or 'loop'
+    :param compact: Return the pairs as int32 and the distances as float32
+    :param return_tree: Also return the cKDTree, e.g. for snap_to_cities
+    :param workers: Number of threads of the 'pairs' search, all cores if -1
+    :type coord_list: ndarray
+    :type radius: float
+    :type method: str
+    :type compact: bool
+    :type return_tree: bool
+    :type workers: int
+
+    :return links: Every pair that's within range
+    :return distances: All the pair's distance
+    :return tree: The cKDTree of coord_list, only if return_tree is True
+    :rtype links: ndarray
+    :rtype distances: ndarray
+    :rtype tree: cKDTree
+    """
+
+    # Uses cKDTree to cut down on time
+    tree = cKDTree(coord_list)
+
+    if method == 'pairs':
+        pairs = _query_pairs(tree, coord_list, radius, workers)
+        if compact:
+            # Both directions of the pairs and the distances are built in the compact types
+            pairs = _compact_pairs(pairs, len(coord_list))
+        pairs, distances = _both_directions(pairs, _pair_distances(coord_list, pairs,
+                                                                   np.float32 if compact else np.float64))
+
+    elif method == 'sparse':
+        matrix = tree.sparse_distance_matrix(tree, radius, output_type='coo_matrix')
+        keep = matrix.row != matrix.col
+        pairs = np.column_stack((matrix.row[keep], matrix.col[keep])).astype(np.intp)
+        order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+        pairs = pairs[order]
+        distances = _pair_distances(coord_list, pairs)
+
+    elif method == 'loop':
+        # Pre create the lists
+        distances = []
+        pairs = []
+        links = tree.query_ball_tree(tree, radius)
+
+        # After the above use the same thought process to create the pairs as well as check distance
+        for city, near_cities in enumerate(links):
+            for near_city in near_cities:
+                if city != near_city:
+                    # Squared by multiplying, ** 2 of a scalar goes through pow and can differ by an ulp from
+                    # the squares of the other methods
+                    dx = coord_list[city][0] - coord_list[near_city][0]
+                    dy = coord_list[city][1] - coord_list[near_city][1]
+                    dist = np.sqrt(dx*dx + dy*dy)
+                    distances.append(dist)
+                    pairs.append((city, near_city))
+        pairs, distances = np.array(pairs), np.array(distances)
+
+    else:
+        raise ValueError("Unknown method: {}".format(method))
+
+    if compact:
+        pairs, distances = _compact_pairs(pairs, len(coord_list)), distances.astype(np.float32, copy=False)
+
+    if return_tree:
+        return pairs, distances, tree
+    return pairs, distances
+
+
+@stage(counts=_graph_counts)
+def construct_graph(indices, distance, N, compact=False):
     """ Constructing the sparse graph
 
     :param indices: The pairs that are in range
     :param distance: The distances between all the pairs
     :param N: len(coords_list)
+    :param compact: Store the graph with int32 indices and float32 weights
     :type indices: ndarray
     :type distance: ndarray
     :type N: int
+    :type compact: bool
 
     :return matrix: The pairs and it's distance
     :rtype matrix: ndarray
 
     """
 
-    start = time.time()
-    # Pre create the lists
-    row = []
-    col = []
+    # The pair lists of construct_graph_connections are 1-D when no pair is in range
+    indices = np.asarray(indices).reshape(-1, 2)
+
+    # Use csr_matrix as instructed, the columns of indices are used as they are
+    matrix = csr_matrix((distance, (indices[:, 0], indices[:, 1])), shape=(N, N))
+
+    return _compact_graph(matrix) if compact else matrix
+
+
+@stage(counts=_graph_counts)
+def construct_fast_graph(coord_list, radius, tree=None, compact=False, workers=1):
+    """ Constructs the sparse graph directly from the cKDTree query
+
+    Only the upper triangle (i < j) is stored, so the graph has to be searched with directed=False.
+
+    :param coord_list: the coordinate list for respective city
+    :param radius: The radius which will be checked
+    :param tree: cKDTree of coord_list if one is already built
+    :param compact: Store the graph with int32 indices and float32 weights
+    :param workers: Number of threads of the neighbour search, all cores if -1
+    :type coord_list: ndarray
+    :type radius: float
+    :type tree: cKDTree
+    :type compact: bool
+    :type workers: int
+
+    :return matrix: The upper triangle of the graph
+    :rtype matrix: csr_matrix
+    """
+
+    N = len(coord_list)
+    if tree is None:
+        tree = cKDTree(coord_list)
+    pairs = _query_pairs(tree, coord_list, radius, workers)
+    if compact:
+        # The pairs, the distances and the graph are built in the compact types
+        pairs = _compact_pairs(pairs, N)
+    distances = _pair_distances(coord_list, pairs, np.float32 if compact else np.float64)
+    matrix = coo_matrix((distances, (pairs[:, 0], pairs[:, 1])), shape=(N, N)).tocsr()
+
+    return _compact_graph(matrix) if compact else matrix
+
+
+def _compact_pairs(pairs, N):
+    """ Stores the pairs with int32 indices
+
+    :param pairs: (i, j) index pairs
+    :param N: len(coords_list)
+    :type pairs: ndarray
+    :type N: int
+
+    :return pairs: The compact pairs
+    :rtype pairs: ndarray
+    """
+
+    if len(pairs) >= 2**31 or N >= 2**31:
+        raise ValueError("The graph is too large for int32 indices")
+    return pairs.astype(np.int32, copy=False)
+
+
+def _compact_graph(matrix):
+    """ Stores the graph with int32 indices and float32 weights
+
+    :param matrix: The graph
+    :type matrix: csr_matrix
+
+    :return matrix: The compact graph
+    :rtype matrix: csr_matrix
+    """
+
+    if matrix.nnz >= 2**31 or matrix.shape[0] >= 2**31:
+        raise ValueError("The graph is too large for int32 indices")
+    return csr_matrix((matrix.data.astype(np.float32, copy=False), matrix.indices.astype(np.int32, copy=False),
+                       matrix.indptr.astype(np.int32, copy=False)), shape=matrix.shape, copy=False)
+
+
+def compact_path_error(coord_list, radius, sources):
+    """ Compares the path lengths in the compact graph with the ones in the float64 graph
+
+    :param coord_list: the coordinate list for respective city
+    :param radius: The radius which will be checked
+    :param sources: The start cities to compare the paths from
+    :type coord_list: ndarray
+    :type radius: float
+    :type sources: ndarray
+
+    :return error: The largest absolute difference of a path length
+    :return relative_error: The largest relative difference of a path length
+    :rtype error: float
+    :rtype relative_error: float
+    """
+
+    tree = cKDTree(coord_list)
+    exact = shortest_path(construct_fast_graph(coord_list, radius, tree), directed=False, indices=sources)
+    compact = shortest_path(construct_fast_graph(coord_list, radius, tree, compact=True), directed=False,
+                            indices=sources)
+    reached = np.isfinite(exact) & (exact > 0)
+    if not reached.any():
+        return 0.0, 0.0
+    error = np.abs(compact[reached] - exact[reached])
+
+    return float(error.max()), float((error / exact[reached]).max())
+
+
+# Record of a city in the band files of build_graph_out_of_core
+_BAND_RECORD = np.dtype([('index', np.int64), ('x', np.float64), ('y', np.float64)])
+# Record of an edge in the edge file of build_graph_out_of_core
+_EDGE_RECORD = np.dtype([('i', np.int64), ('j', np.int64), ('distance', np.float64)])
+
+
+@stage(counts=_graph_counts)
+def build_graph_out_of_core(filename, radius, directory, chunk_lines=1000000, band_tiles=64):
+    """ Builds the upper triangle graph of a coordinate file that doesn't have to fit in memory
+
+    The file is streamed in chunks and the cities are sorted into horizontal bands of band_tiles grid rows
+    of size radius, each band in its own file. The edges are then found one band at a time with a
+    cKDTree over the band and the cities of the next band that are within radius of it, so only two
+    neighbouring bands are in memory at once. The edges are finally sorted into a CSR graph whose arrays
+    are memory-mapped files in directory, see load_out_of_core_graph.
+
+    :param filename: File with coordinates
+    :param radius: The radius which will be checked
+    :param directory: Directory for the memory-mapped arrays and the temporary files
+    :param chunk_lines: Number of lines read at a time
+    :param band_tiles: Height of a band in grid rows, a band has to fit in memory
+    :type filename: txt
+    :type radius: float
+    :type directory: str
+    :type chunk_lines: int
+    :type band_tiles: int
+
+    :return matrix: The upper triangle of the graph, backed by files in directory
+    :rtype matrix: csr_matrix
+    """
 
-    for k in indices:
-        row.append(k[0])
-        col.append(k[1])
+    os.makedirs(directory, exist_ok=True)
+    band_height = band_tiles * radius
+
+    def band_file(band):
+        return os.path.join(directory, 'band_%d.bin' % band)
+
+    # Pass 1, stream the file into the coordinate file and the band files. The band files are appended
+    # to, so the ones left by a run that was stopped are removed first
+    for name in os.listdir(directory):
+        if name.startswith('band_') and name.endswith('.bin'):
+            os.remove(os.path.join(directory, name))
+    N = 0
+    bands = set()
+    with open(os.path.join(directory, 'coords.bin'), 'wb') as coords_file:
+        for coords in read_coordinate_chunks(filename, chunk_lines):
+            coords.tofile(coords_file)
+            records = np.empty(len(coords), dtype=_BAND_RECORD)
+            records['index'] = np.arange(N, N + len(coords))
+            records['x'], records['y'] = coords[:, 0], coords[:, 1]
+            band_of = np.floor(coords[:, 1] / band_height).astype(np.int64)
+            # Sorted on the band every band is a slice of the chunk
+            order = np.argsort(band_of, kind='stable')
+            records, band_of = records[order], band_of[order]
+            chunk_bands, starts = np.unique(band_of, return_index=True)
+            for band, first, last in zip(chunk_bands.tolist(), starts.tolist(), starts[1:].tolist() + [len(records)]):
+                with open(band_file(band), 'ab') as f:
+                    records[first:last].tofile(f)
+                bands.add(band)
+            N += len(coords)
+
+    # Pass 2, find the edges band by band
+    n_edges = 0
+    with open(os.path.join(directory, 'edges.bin'), 'wb') as edges_file:
+        for band in sorted(bands):
+            cities = np.fromfile(band_file(band), dtype=_BAND_RECORD)
+            n_band = len(cities)
+            if band + 1 in bands:
+                # Only the cities close to the border of the next band can be connected to this band,
+                # with a little slack for the rounding of the border
+                after = np.fromfile(band_file(band + 1), dtype=_BAND_RECORD)
+                border = (band + 1) * band_height + 1.000001 * radius
+                cities = np.concatenate((cities, after[after['y'] <= border]))
+                del after
+            coords = np.column_stack((cities['x'], cities['y']))
+            pairs = cKDTree(coords).query_pairs(radius, output_type='ndarray')
+            # Pairs with both cities in the next band are found with that band
+            pairs = pairs[np.minimum(pairs[:, 0], pairs[:, 1]) < n_band]
+
+            edges = np.empty(len(pairs), dtype=_EDGE_RECORD)
+            i, j = cities['index'][pairs[:, 0]], cities['index'][pairs[:, 1]]
+            edges['i'], edges['j'] = np.minimum(i, j), np.maximum(i, j)
+            edges['distance'] = _pair_distances(coords, pairs)
+            edges.tofile(edges_file)
+            n_edges += len(edges)
+        for band in bands:
+            os.remove(band_file(band))
+
+    # Pass 3, counting sort of the edges on their first city into the memory-mapped CSR arrays
+    index_dtype = np.int32 if max(N, n_edges) < 2**31 else np.int64
+    # np.memmap can't map an empty file, which the edge file is if no cities are within radius
+    edges = np.memmap(os.path.join(directory, 'edges.bin'), dtype=_EDGE_RECORD, mode='r', shape=(n_edges,)) \
+        if n_edges else np.empty(0, dtype=_EDGE_RECORD)
+    indptr = _create_array(os.path.join(directory, 'indptr.npy'), index_dtype, N + 1)
+    indices = _create_array(os.path.join(directory, 'indices.npy'), index_dtype, n_edges)
+    data = _create_array(os.path.join(directory, 'data.npy'), np.float64, n_edges)
+    indptr[:] = 0
+    for first in range(0, n_edges, chunk_lines):
+        rows, counts = np.unique(edges['i'][first:first + chunk_lines], return_counts=True)
+        indptr[rows + 1] += counts
+    np.cumsum(indptr, out=indptr)
+
+    cursor = _create_array(os.path.join(directory, 'cursor.npy'), index_dtype, N)
+    cursor[:] = indptr[:-1]
+    for first in range(0, n_edges, chunk_lines):
+        chunk = np.asarray(edges[first:first + chunk_lines])
+        chunk = chunk[np.argsort(chunk['i'], kind='stable')]
+        rows, starts, counts = np.unique(chunk['i'], return_index=True, return_counts=True)
+        position = cursor[chunk['i']] + (np.arange(len(chunk)) - np.repeat(starts, counts))
+        indices[position] = chunk['j']
+        data[position] = chunk['distance']
+        cursor[rows] += counts.astype(index_dtype)
+    del edges, cursor
+    os.remove(os.path.join(directory, 'edges.bin'))
+    os.remove(os.path.join(directory, 'cursor.npy'))
+    for array in (indptr, indices, data):
+        array.flush()
+
+    with open(os.path.join(directory, 'graph.json'), 'w') as f:
+        json.dump({'N': N, 'edges': n_edges, 'radius': radius}, f)
+
+    return load_out_of_core_graph(directory)[1]
+
+
+def _create_array(path, dtype, length):
+    """ Creates a memory-mapped .npy file for build_graph_out_of_core
+
+    :param path: The .npy file
+    :param dtype: Type of the array
+    :param length: Number of elements
+    :type path: str
+    :type dtype: dtype
+    :type length: int
+
+    :return array: The array, writable
+    :rtype array: memmap
+    """
+
+    if length == 0:
+        # Written with np.save since mapping an empty array for writing isn't supported by every NumPy
+        np.save(path, np.empty(0, dtype=dtype))
+        return np.load(path, mmap_mode='r+')
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(length,))
+
+
+def load_out_of_core_graph(directory):
+    """ Opens a graph built with build_graph_out_of_core without reading it into memory
+
+    :param directory: The directory the graph was built in
+    :type directory: str
+
+    :return coords: The memory-mapped coordinates
+    :return matrix: The upper triangle of the graph, backed by the files in directory
+    :rtype coords: ndarray
+    :rtype matrix: csr_matrix
+    """
+
+    with open(os.path.join(directory, 'graph.json')) as f:
+        N = json.load(f)['N']
+    # np.memmap can't map the empty coordinate file of an empty coordinate file
+    coords = np.memmap(os.path.join(directory, 'coords.bin'), dtype=np.float64, mode='r', shape=(N, 2)) if N \
+        else np.empty((0, 2))
 
-    # Use csr_matrix as instructed
-    matrix = csr_matrix((distance, (row, col)), shape=(N, N))
+    def load(name):
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
 
-    end = time.time()
-    time5 = end - start
-    print("Time of construct_graph  : %.3f" % time5)
+    matrix = csr_matrix((load('data'), load('indices'), load('indptr')), shape=(N, N), copy=False)
 
-    return matrix
+    return coords, matrix
 
 
-def find_shortest_path(graph, start):
+@stage(counts=lambda result: {'reached': int(np.isfinite(result[0]).sum())})
+def find_shortest_path(graph, start, directed=True):
     """ Finds the shortest paths from start to all other cities
 
     :param graph: The pairs and it's distance
     :param start: The start city
+    :param directed: False if the graph only stores one direction of every edge, see construct_fast_graph
     :type graph: ndarray
     :type start: int
+    :type directed: bool
 
     :return path: The shortest path from start to all other cities
     :return predecessor: Previous city when taking the shortest path to the given column index
@@ -210,19 +993,331 @@ def find_shortest_path(graph, start):
 
     """
 
-    start1 = time.time()
-    path, predecessor = shortest_path(graph, indices=start, return_predecessors=True)
-
-    end = time.time()
-    time6 = end - start1
-    print("Time of find_shortest_path  : %.3f" % time6)
+    path, predecessor = shortest_path(graph, directed=directed, indices=start, return_predecessors=True)
 
     return path, predecessor
 
 
 
-def compute_path(predecessor_matrix, start_node, end_node):
-    """ converts the shortest path to a sequence of nodes that represent it
+@stage(counts=lambda result: {'components': len(result[1])})
+def graph_components(graph, directed=True):
+    """ Labels the connected components of the graph, two cities have a path between them only if their
+    labels are the same
+
+    :param graph: The pairs and it's distance
+    :param directed: False if the graph only stores one direction of every edge, see construct_fast_graph
+    :type graph: csr_matrix
+    :type directed: bool
+
+    :return labels: The component of every city
+    :return sizes: Number of cities in every component
+    :rtype labels: ndarray
+    :rtype sizes: ndarray
+    """
+
+    # The edges go both ways so weak and strong components are the same
+    _, labels = connected_components(graph, directed=directed, connection='weak')
+
+    return labels, np.bincount(labels)
+
+
+def symmetric_graph(graph):
+    """ Adds the missing direction of every edge, e.g. to the upper triangle from construct_fast_graph
+
+    :param graph: The pairs and it's distance
+    :type graph: csr_matrix
+
+    :return graph: The graph with both directions of every edge
+    :rtype graph: csr_matrix
+    """
+
+    return graph.maximum(graph.T).tocsr()
+
+
+@stage(counts=lambda result: {'path_nodes': len(result[1])})
+def find_route(graph, coord_list, start, end, directed=True, labels=None, max_edge=None):
+    """ Finds the shortest path between one pair of cities with Dijkstra searches that stop at a distance limit
+
+    The straight line distance in the projected coordinates never overestimates the remaining path since
+    all edge weights are straight line distances. The first search stops at ROUTE_SLACK times that bound
+    and the limit grows by ROUTE_GROWTH until end is reached. The distances below the limit are exact, so
+    the path is the same as from find_shortest_path, but only the cities closer than the limit are visited.
+
+    With directed=False scipy adds the other direction of every edge on every call. For many queries on the
+    upper triangle from construct_fast_graph, build symmetric_graph(graph) once and pass it with directed=True.
+
+    :param graph: The pairs and it's distance
+    :param coord_list: the coordinate list for respective city
+    :param start: The start city
+    :param end: The end city
+    :param directed: False if the graph only stores one direction of every edge, see construct_fast_graph
+    :param labels: Components from graph_components, cities in different components are rejected at once
+    :param max_edge: Length of the longest edge, e.g. the radius, taken from the graph if None
+    :type graph: csr_matrix
+    :type coord_list: ndarray
+    :type start: int
+    :type end: int
+    :type directed: bool
+    :type labels: ndarray
+    :type max_edge: float
+
+    :return distance: The length of the shortest path, inf if end can't be reached
+    :return path_seq: shortest path from start to end city, empty if end can't be reached
+    :rtype distance: float
+    :rtype path_seq: ndarray
+    """
+
+    if labels is not None and labels[start] != labels[end]:
+        return np.inf, np.array([], dtype=int)
+    if max_edge is None:
+        max_edge = graph.data.max() if graph.nnz else 0.0
+
+    diff = coord_list[end] - coord_list[start]
+    # The limit grows by at least 2 * max_edge, so when no new city was reached the component is done
+    limit = ROUTE_SLACK * np.sqrt(diff[0]**2 + diff[1]**2) + 4 * max_edge
+    reached = -1
+    while True:
+        distances, predecessor = dijkstra(graph, directed=directed, indices=start, limit=limit,
+                                          return_predecessors=True)
+        if np.isfinite(distances[end]):
+            return distances[end], _walk_predecessors(predecessor, start, end)
+        n_reached = np.count_nonzero(predecessor >= 0)
+        if n_reached == reached:
+            return np.inf, np.array([], dtype=int)
+        reached = n_reached
+        limit *= ROUTE_GROWTH
+
+
+@stage(counts=lambda result: {'landmarks': len(result[0])})
+def build_landmarks(graph, n_landmarks=16, directed=True):
+    """ Preprocesses the graph for find_route_alt by picking landmarks and the distances from them to all cities
+
+    The landmarks are picked one at a time in the largest component of the graph, as the city furthest
+    away from the landmarks picked so far.
+
+    :param graph: The pairs and it's distance
+    :param n_landmarks: Number of landmarks
+    :param directed: False if the graph only stores one direction of every edge, see construct_fast_graph
+    :type graph: csr_matrix
+    :type n_landmarks: int
+    :type directed: bool
+
+    :return landmarks: The landmark cities
+    :return distances: Distance from every landmark (rows) to every city (columns)
+    :rtype landmarks: ndarray
+    :rtype distances: ndarray
+    """
+
+    _, labels = connected_components(graph, directed=directed, connection='weak')
+    largest = np.nonzero(labels == np.argmax(np.bincount(labels)))[0]
+    n_landmarks = min(n_landmarks, len(largest))
+    landmarks = np.zeros(n_landmarks, dtype=np.intp)
+    distances = np.zeros((n_landmarks, graph.shape[0]))
+    # Start from the city furthest away from an arbitrary city of the component
+    closest = shortest_path(graph, directed=directed, indices=largest[0])
+
+    for k in range(n_landmarks):
+        candidate = int(np.argmax(np.where(np.isinf(closest), -1, closest)))
+        landmarks[k] = candidate
+        distances[k] = shortest_path(graph, directed=directed, indices=candidate)
+        closest = distances[k] if k == 0 else np.minimum(closest, distances[k])
+
+    return landmarks, distances
+
+
+def save_landmarks(filename, landmarks, distances):
+    """ Saves the output of build_landmarks
+
+    :param filename: The .npz file to write
+    :param landmarks: The landmark cities
+    :param distances: Distance from every landmark to every city
+    :type filename: str
+    :type landmarks: ndarray
+    :type distances: ndarray
+    """
+
+    np.savez(filename, landmarks=landmarks, distances=distances)
+
+
+def load_landmarks(filename):
+    """ Loads landmarks saved with save_landmarks
+
+    :param filename: The .npz file
+    :type filename: str
+
+    :return landmarks: The landmark cities
+    :return distances: Distance from every landmark to every city
+    :rtype landmarks: ndarray
+    :rtype distances: ndarray
+    """
+
+    with np.load(filename) as f:
+        return f['landmarks'], f['distances']
+
+
+@stage(counts=lambda result: {'path_nodes': len(result[1])})
+def find_route_alt(graph, landmark_distances, start, end, coord_list=None, directed=True):
+    """ Finds the shortest path between one pair of cities with a Dijkstra search pruned by landmark lower bounds
+
+    By the triangle inequality |d(L, start) - d(L, city)| + |d(L, city) - d(L, end)| never overestimates the
+    length of the shortest path from start to end through city. Every city of a path not longer than a limit
+    therefore has a lower bound not above the limit, so a Dijkstra search over only those cities finds the
+    path if it's within the limit. The bounds use the ALT_ACTIVE_LANDMARKS landmarks that separate start
+    and end the most. The first limit is ALT_SLACK times the lower bound of the distance and grows by
+    ROUTE_GROWTH up to min over L of d(L, start) + d(L, end), which is never shorter than the path, so
+    the path is the same as from find_shortest_path. The graphs of this module have the same length in
+    both directions, which the bounds need.
+
+    If no landmark is in the component of the cities there are no bounds, and with coord_list given the
+    search falls back to find_route.
+
+    :param graph: The pairs and it's distance
+    :param landmark_distances: The distances from build_landmarks
+    :param start: The start city
+    :param end: The end city
+    :param coord_list: the coordinate list for respective city
+    :param directed: False if the graph only stores one direction of every edge, see construct_fast_graph
+    :type graph: csr_matrix
+    :type landmark_distances: ndarray
+    :type start: int
+    :type end: int
+    :type coord_list: ndarray
+    :type directed: bool
+
+    :return distance: The length of the shortest path, inf if end can't be reached
+    :return path_seq: shortest path from start to end city, empty if end can't be reached
+    :rtype distance: float
+    :rtype path_seq: ndarray
+    """
+
+    from_start, to_end = landmark_distances[:, start], landmark_distances[:, end]
+    if np.any(np.isinf(from_start) != np.isinf(to_end)):
+        # A landmark reaches one of the cities but not the other, so they are in different components
+        return np.inf, np.array([], dtype=int)
+
+    upper = np.min(from_start + to_end, initial=np.inf)
+    if np.isinf(upper):
+        if coord_list is not None:
+            return find_route(graph, coord_list, start, end, directed=directed)
+        distances, predecessor = dijkstra(graph, directed=directed, indices=start, return_predecessors=True)
+        if np.isinf(distances[end]):
+            return np.inf, np.array([], dtype=int)
+        return distances[end], _walk_predecessors(predecessor, start, end)
+
+    gap = np.abs(from_start - to_end)
+    active = np.argpartition(gap, len(gap) - min(ALT_ACTIVE_LANDMARKS, len(gap)))[-ALT_ACTIVE_LANDMARKS:]
+    rows = landmark_distances[active]
+    lower = np.abs(rows - from_start[active, None]).max(axis=0) + np.abs(rows - to_end[active, None]).max(axis=0)
+
+    limit = min(ALT_SLACK * gap.max(), upper)
+    while True:
+        # A little slack so that the rounding of the bounds never cuts off a city of the path
+        cities = np.flatnonzero(lower <= limit * (1 + 1e-9))
+        first, last = np.searchsorted(cities, [start, end])
+        distances, predecessor = dijkstra(graph[cities][:, cities], directed=directed, indices=first,
+                                          limit=limit * (1 + 1e-9), return_predecessors=True)
+        if np.isfinite(distances[last]):
+            return distances[last], cities[_walk_predecessors(predecessor, first, last)]
+        if limit >= upper:
+            return np.inf, np.array([], dtype=int)
+        limit = min(limit * ROUTE_GROWTH, upper) if limit > 0 else upper
+
+
+# Graph and result arrays of the worker processes of find_shortest_paths_parallel
+_worker_state = {}
+
+
+def _attach_worker(directory, N, directed):
+    """ Memory-maps the graph and the result arrays in a worker process of find_shortest_paths_parallel
+
+    :param directory: Directory holding the memory-mapped arrays
+    :param N: len(coords_list)
+    :param directed: False if the graph only stores one direction of every edge
+    :type directory: str
+    :type N: int
+    :type directed: bool
+    """
+
+    def load(name, mode='r'):
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode=mode)
+
+    # Only the result arrays are written by the workers
+    _worker_state['graph'] = csr_matrix((load('data'), load('indices'), load('indptr')), shape=(N, N), copy=False)
+    _worker_state['sources'] = load('sources')
+    _worker_state['path'] = load('path', 'r+')
+    _worker_state['predecessor'] = load('predecessor', 'r+')
+    _worker_state['directed'] = directed
+
+
+def _shortest_path_rows(first, last):
+    """ Runs the searches from sources[first:last] and writes them to the shared result rows
+
+    :param first: First row
+    :param last: One past the last row
+    :type first: int
+    :type last: int
+    """
+
+    state = _worker_state
+    path, predecessor = shortest_path(state['graph'], directed=state['directed'],
+                                      indices=np.array(state['sources'][first:last]), return_predecessors=True)
+    state['path'][first:last] = path
+    state['predecessor'][first:last] = predecessor
+
+
+@stage(counts=lambda result: {'sources': len(result[0])})
+def find_shortest_paths_parallel(graph, sources, directed=True, workers=None, rows_per_task=None):
+    """ Finds the shortest paths from every city in sources to all other cities with a pool of processes
+
+    The graph and the result matrices are memory-mapped files that every worker maps, so neither the
+    graph nor the results are pickled between the processes.
+
+    :param graph: The pairs and it's distance
+    :param sources: The start cities
+    :param directed: False if the graph only stores one direction of every edge, see construct_fast_graph
+    :param workers: Number of processes, all cores if None
+    :param rows_per_task: Number of sources searched per task, a few tasks per worker if None
+    :type graph: csr_matrix
+    :type sources: ndarray
+    :type directed: bool
+    :type workers: int
+    :type rows_per_task: int
+
+    :return path: The shortest path from every source to all other cities, one row per source
+    :return predecessor: Previous city when taking the shortest path, one row per source
+    :rtype path: ndarray
+    :rtype predecessor: ndarray
+    """
+
+    graph = csr_matrix(graph)
+    sources = np.asarray(sources, dtype=np.intp).ravel()
+    N, S = graph.shape[0], len(sources)
+    workers = workers or os.cpu_count() or 1
+    rows_per_task = rows_per_task or max(1, -(-S // (4 * workers)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, array in (('data', graph.data), ('indices', graph.indices), ('indptr', graph.indptr),
+                            ('sources', sources)):
+            np.save(os.path.join(directory, name + '.npy'), array)
+        path = np.lib.format.open_memmap(os.path.join(directory, 'path.npy'), mode='w+', dtype=np.float64, shape=(S, N))
+        predecessor = np.lib.format.open_memmap(os.path.join(directory, 'predecessor.npy'), mode='w+',
+                                                dtype=np.int32, shape=(S, N))
+        del path, predecessor
+
+        with ProcessPoolExecutor(workers, initializer=_attach_worker, initargs=(directory, N, directed)) as pool:
+            tasks = [pool.submit(_shortest_path_rows, first, min(first + rows_per_task, S))
+                     for first in range(0, S, rows_per_task)]
+            for task in tasks:
+                task.result()
+
+        path = np.load(os.path.join(directory, 'path.npy'))
+        predecessor = np.load(os.path.join(directory, 'predecessor.npy'))
+
+    return path, predecessor
+
+
+def _walk_predecessors(predecessor_matrix, start_node, end_node):
+    """ Follows the predecessors back from end_node to start_node
 
     :param predecessor_matrix: Previous city when taking the shortest path to the given column index
     :param start_node: The city which to start on
@@ -235,30 +1330,495 @@ def compute_path(predecessor_matrix, start_node, end_node):
     :rtype path_seq: ndarray
     """
 
-    start = time.time()
-
     path_seq = [end_node]
     new_node = end_node
 
     while new_node != start_node:
         new_node = predecessor_matrix[new_node]
+        if new_node < 0:
+            raise ValueError("City {} can't be reached from {}".format(end_node, start_node))
         path_seq.append(new_node)
-    path_seq = np.flip(path_seq)
 
-    end = time.time()
-    time7 = end - start
-    print("Time of compute_path  : %.3f" % time7)
+    return np.flip(path_seq)
+
+
+@stage(counts=lambda path_seq: {'path_nodes': len(path_seq)})
+def compute_path(predecessor_matrix, start_node, end_node):
+    """ converts the shortest path to a sequence of nodes that represent it
+
+    :param predecessor_matrix: Previous city when taking the shortest path to the given column index
+    :param start_node: The city which to start on
+    :param end_node: The city which to end on
+    :type predecessor_matrix: ndarray
+    :type start_node: int
+    :type end_node: int
+
+    :return path_seq: shortest path from start to end city
+    :rtype path_seq: ndarray
+
+    :raises ValueError: if end_node can't be reached from start_node
+    """
+
+    path_seq = _walk_predecessors(predecessor_matrix, start_node, end_node)
 
     return path_seq
 
 
+@stage(counts=lambda result: {'paths': len(result[1]) - 1, 'path_nodes': len(result[0])})
+def compute_paths(predecessor_matrix, start_node, end_nodes):
+    """ converts the shortest paths from start_node to many end nodes to sequences of nodes at once
+
+    All paths are followed back one step at a time together, the paths are returned after each other
+    in one flat array where path k is path_flat[offsets[k]:offsets[k + 1]].
+
+    :param predecessor_matrix: Previous city when taking the shortest path to the given column index
+    :param start_node: The city which to start on
+    :param end_nodes: The cities which to end on
+    :type predecessor_matrix: ndarray
+    :type start_node: int
+    :type end_nodes: ndarray
+
+    :return path_flat: shortest paths from start to the end cities after each other
+    :return offsets: Start of every path in path_flat, with len(end_nodes) + 1 entries
+    :return unreachable: True for the end cities that can't be reached, their paths are empty
+    :rtype path_flat: ndarray
+    :rtype offsets: ndarray
+    :rtype unreachable: ndarray
+    """
+
+    predecessor_matrix = np.asarray(predecessor_matrix)
+    end_nodes = np.asarray(end_nodes, dtype=np.intp).ravel()
+    unreachable = (end_nodes != start_node) & (predecessor_matrix[end_nodes] < 0)
+
+    # Walk all paths back together and remember which node every path had at every step
+    current = end_nodes.copy()
+    lengths = (~unreachable).astype(np.intp)
+    steps = [(np.nonzero(~unreachable)[0], end_nodes[~unreachable])]
+    active = steps[0][0][current[steps[0][0]] != start_node]
+    while len(active):
+        if len(steps) > len(predecessor_matrix):
+            raise ValueError("The predecessors contain a cycle")
+        current[active] = predecessor_matrix[current[active]]
+        lengths[active] += 1
+        steps.append((active, current[active]))
+        active = active[current[active] != start_node]
+
+    offsets = np.zeros(len(end_nodes) + 1, dtype=np.intp)
+    np.cumsum(lengths, out=offsets[1:])
+    path_flat = np.empty(offsets[-1], dtype=np.intp)
+    # Step k of a path is k positions from its end
+    for k, (paths, nodes) in enumerate(steps):
+        path_flat[offsets[paths] + lengths[paths] - 1 - k] = nodes
+
+    return path_flat, offsets, unreachable
+
+
+class RouteEngine:
+    """
+    Loads the cities, builds the KD-tree and the graph once and then answers many route queries against them
+
+    The component of every city is stored in labels and the number of cities of every component in
+    component_sizes, queries between components are answered as unreachable without a search.
+    """
+
+    def __init__(self, coord_list, radius, batch_sources=256, compact=False):
+        """
+        Builds the KD-tree, the upper triangle graph of the cities and its symmetric copy
+
+        :param coord_list: the coordinate list for respective city
+        :param radius: The radius which will be checked
+        :param batch_sources: Number of sources searched at the same time, bounds the memory of route_many
+        :param compact: Store the graph with int32 indices and float32 weights
+        """
+        self.coord_list = coord_list
+        self.radius = radius
+        self.batch_sources = batch_sources
+        self.tree = cKDTree(coord_list)
+        self.graph = construct_fast_graph(coord_list, radius, self.tree, compact=compact)
+        # Both directions of every edge, built once so that the searches don't add them on every query
+        self.symmetric = symmetric_graph(self.graph)
+        self.labels, self.component_sizes = graph_components(self.graph, directed=False)
+        self.queries_per_second = None
+
+    @classmethod
+    def from_file(cls, filename, radius, **kwargs):
+        """
+        Creates the engine from a coordinate file
+
+        :param filename: File with coordinates
+        :param radius: The radius which will be checked
+        :return: The engine
+        """
+        return cls(read_coordinate_file(filename), radius, **kwargs)
+
+    def snap(self, latlon, k=1):
+        """
+        Finds the k nearest cities of raw latitude/longitude positions, see snap_to_cities
+
+        :param latlon: Latitudes in the first column and longitudes in the second
+        :param k: Number of nearest cities per position
+        :return: The projected distances and the cities
+        """
+        return snap_to_cities(self.tree, latlon, k)
+
+    def route_coordinates(self, start_latlon, end_latlon):
+        """
+        Routes between raw latitude/longitude positions by snapping them to their nearest cities
+
+        :param start_latlon: Latitude and longitude of every start position
+        :param end_latlon: Latitude and longitude of every end position
+        :return: A list with the distance and the path of every query, see route_many
+        """
+        _, starts = self.snap(start_latlon)
+        _, ends = self.snap(end_latlon)
+        return self.route_many(np.column_stack((starts, ends)))
+
+    def reachable(self, start, end):
+        """
+        Checks in constant time if there is a path between two cities
+
+        :param start: The start city
+        :param end: The end city
+        :return: True if both cities are in the same component
+        """
+        return self.labels[start] == self.labels[end]
+
+    def route(self, start, end):
+        """
+        Answers a single query with find_route, which only searches the cities closer than about the distance
+        to end
+
+        :param start: The start city
+        :param end: The end city
+        :return: The distance and the path, inf and an empty path if end can't be reached
+        """
+        return find_route(self.symmetric, self.coord_list, start, end, labels=self.labels, max_edge=self.radius)
+
+    @stage(counts=lambda results: {'queries': len(results)})
+    def route_many(self, queries):
+        """
+        Answers a batch of (start, end) queries, the queries are grouped on their start city so every start
+        city is only searched once
+
+        :param queries: The (start, end) pairs
+        :return: A list with the distance and the path of every query, in the same order as queries
+        """
+
+        start = time.perf_counter()
+        queries = np.asarray(queries, dtype=int).reshape(-1, 2)
+        results = [None] * len(queries)
+
+        # Cities in different components are answered without a search
+        connected = self.labels[queries[:, 0]] == self.labels[queries[:, 1]]
+        for q in np.nonzero(~connected)[0]:
+            results[q] = (np.inf, np.array([], dtype=np.intp))
+        routed = np.nonzero(connected)[0]
+        sources, group = np.unique(queries[routed, 0], return_inverse=True)
+        # The queries of every source after each other, source k has routed[bounds[k]:bounds[k + 1]]
+        order = np.argsort(group, kind='stable')
+        routed = routed[order]
+        bounds = np.searchsorted(group[order], np.arange(len(sources) + 1))
+
+        for first in range(0, len(sources), self.batch_sources):
+            batch = sources[first:first + self.batch_sources]
+            distances, predecessors = shortest_path(self.symmetric, indices=batch, return_predecessors=True)
+            for row in range(len(batch)):
+                group_queries = routed[bounds[first + row]:bounds[first + row + 1]]
+                ends = queries[group_queries, 1]
+                path_flat, offsets, unreachable = compute_paths(predecessors[row], batch[row], ends)
+                for k, q in enumerate(group_queries):
+                    distance = np.inf if unreachable[k] else distances[row, ends[k]]
+                    results[q] = (distance, path_flat[offsets[k]:offsets[k + 1]])
+
+        elapsed = time.perf_counter() - start
+        self.queries_per_second = len(queries) / elapsed if elapsed > 0 else np.inf
+
+        return results
+
+
+class RadiusSweep:
+    """
+    Searches the neighbours once at the largest radius and then builds the graph for any smaller radius
+    from the edges sorted on their length, to try many radii without repeating the neighbour search
+    """
+
+    def __init__(self, coord_list, max_radius, tree=None):
+        """
+        Finds and sorts all edges up to max_radius
+
+        :param coord_list: the coordinate list for respective city
+        :param max_radius: The largest radius that will be asked for
+        :param tree: cKDTree of coord_list if one is already built
+        """
+        self.coord_list = coord_list
+        self.max_radius = max_radius
+        if tree is None:
+            tree = cKDTree(coord_list)
+        pairs = tree.query_pairs(max_radius, output_type='ndarray')
+        distances = _pair_distances(coord_list, pairs)
+        order = np.argsort(distances, kind='stable')
+        self.pairs = pairs[order]
+        self.distances = distances[order]
+
+    def n_edges(self, radius):
+        """
+        :param radius: The radius which will be checked
+        :return: Number of edges not longer than radius
+        """
+        if radius > self.max_radius:
+            raise ValueError("radius {} is larger than max_radius {}".format(radius, self.max_radius))
+        return int(np.searchsorted(self.distances, radius, side='right'))
+
+    @stage(counts=_graph_counts)
+    def graph(self, radius):
+        """
+        Builds the graph for radius from the shortest edges
+
+        :param radius: The radius which will be checked
+        :return: The upper triangle graph in the same form as construct_fast_graph
+        """
+        k = self.n_edges(radius)
+        N = len(self.coord_list)
+        return coo_matrix((self.distances[:k], (self.pairs[:k, 0], self.pairs[:k, 1])), shape=(N, N)).tocsr()
+
+    @stage(counts=lambda results: {'radii': len(results)})
+    def sweep(self, radii, start=None, end=None):
+        """
+        Reports the connectivity of the graph for every radius, and the length of the path from start to end
+
+        :param radii: The radii to try
+        :param start: The start city, the path length is left out if None
+        :param end: The end city
+        :return: A list with one dict per radius with the keys 'radius', 'edges', 'components',
+            'largest_component' and 'path_length' (inf if end can't be reached)
+        """
+        results = []
+        for radius in radii:
+            graph = self.graph(radius)
+            n_components, labels = connected_components(graph, directed=False)
+            result = {'radius': radius, 'edges': graph.nnz, 'components': n_components,
+                      'largest_component': int(np.bincount(labels).max()) if len(labels) else 0}
+            if start is not None:
+                result['path_length'] = float(shortest_path(graph, directed=False, indices=start)[end])
+            results.append(result)
+        return results
+
+
+class DynamicGraph:
+    """
+    Graph of the cities within radius of each other that is patched when cities are added or removed,
+    instead of being rebuilt. It can be kept on disk as a snapshot and a log of the changes since then.
+
+    The snapshot and the first line of the log hold a generation number that save increases. A log whose
+    generation differs from the snapshot's is left over from before the snapshot and is not replayed, so
+    a crash between writing the snapshot and the new log can't apply the old changes twice.
+
+    The cities keep their index when other cities are removed, removed cities are left without edges.
+    """
+
+    SNAPSHOT = 'snapshot.npz'
+    DELTA_LOG = 'delta.log'
+
+    def __init__(self, coord_list, radius, directory=None):
+        """
+        Builds the graph of the cities, the changes are logged to directory if it is given
+
+        :param coord_list: the coordinate list for respective city
+        :param radius: The radius which will be checked
+        :param directory: Directory of the snapshot and the delta log
+        """
+        coord_list = np.asarray(coord_list, dtype=np.float64).reshape(-1, 2)
+        pairs = cKDTree(coord_list).query_pairs(radius, output_type='ndarray') if len(coord_list) else \
+            np.empty((0, 2), dtype=np.intp)
+        self._build(coord_list, np.ones(len(coord_list), dtype=bool), radius, pairs, _pair_distances(coord_list, pairs))
+        if directory is not None:
+            self.save(directory)
+
+    def _build(self, coord_list, active, radius, pairs, distances):
+        """
+        Fills the grid and the neighbour dicts from the cities and the edges
+        """
+        self.radius = radius
+        # The arrays have room for more cities so an insert doesn't have to copy them
+        self._size = len(coord_list)
+        self._coords = np.empty((max(16, 2 * self._size), 2))
+        self._coords[:self._size] = coord_list
+        self._active = np.zeros(len(self._coords), dtype=bool)
+        self._active[:self._size] = active
+        self.neighbours = [{} for i in range(len(coord_list))]
+        for (i, j), dist in zip(pairs.tolist(), distances.tolist()):
+            self.neighbours[i][j] = dist
+            self.neighbours[j][i] = dist
+        # Grid with cells of size radius, so the neighbours of a city are in the 3 x 3 cells around it
+        self.cells = {}
+        for city in np.nonzero(active)[0].tolist():
+            self.cells.setdefault(self._cell(self.coord_list[city]), set()).add(city)
+        self.directory = None
+        self.generation = 0
+
+    @property
+    def coord_list(self):
+        """
+        :return: The coordinates of all cities, removed cities included
+        """
+        return self._coords[:self._size]
+
+    @property
+    def active(self):
+        """
+        :return: False for the removed cities
+        """
+        return self._active[:self._size]
+
+    def _cell(self, coords):
+        """
+        :return: The grid cell of the coordinates
+        """
+        return int(np.floor(coords[0] / self.radius)), int(np.floor(coords[1] / self.radius))
+
+    def __len__(self):
+        """
+        :return: Number of city indices, removed cities included
+        """
+        return len(self.coord_list)
+
+    def insert(self, coords):
+        """
+        Adds cities and connects them to the cities within radius
+
+        :param coords: Projected coordinates of the new cities, see mercator_projection
+        :return: The indices of the new cities
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        first = self._size
+        if first + len(coords) > len(self._coords):
+            capacity = max(2 * len(self._coords), first + len(coords))
+            self._coords = np.concatenate((self._coords, np.empty((capacity - len(self._coords), 2))))
+            self._active = np.concatenate((self._active, np.zeros(capacity - len(self._active), dtype=bool)))
+        self._coords[first:first + len(coords)] = coords
+        self._active[first:first + len(coords)] = True
+        self._size = first + len(coords)
+        r2 = self.radius**2
+
+        for city in range(first, first + len(coords)):
+            self.neighbours.append({})
+            cx, cy = self._cell(self.coord_list[city])
+            near = [other for dx in (-1, 0, 1) for dy in (-1, 0, 1) for other in self.cells.get((cx + dx, cy + dy), ())]
+            if near:
+                near = np.array(near)
+                diff = self.coord_list[near] - self.coord_list[city]
+                dist2 = diff[:, 0]**2 + diff[:, 1]**2
+                for near_city, dist in zip(near[dist2 <= r2].tolist(), np.sqrt(dist2[dist2 <= r2]).tolist()):
+                    self.neighbours[city][near_city] = dist
+                    self.neighbours[near_city][city] = dist
+            self.cells.setdefault((cx, cy), set()).add(city)
+
+        self._log({'op': 'insert', 'coords': coords.tolist()})
+        return np.arange(first, first + len(coords))
+
+    def delete(self, cities):
+        """
+        Removes cities and their edges
+
+        :param cities: The indices of the cities to remove
+        """
+        cities = [int(city) for city in np.atleast_1d(cities)]
+        for city in cities:
+            if not self.active[city]:
+                continue
+            for near_city in self.neighbours[city]:
+                del self.neighbours[near_city][city]
+            self.neighbours[city] = {}
+            self.cells[self._cell(self.coord_list[city])].discard(city)
+            self._active[city] = False
+
+        self._log({'op': 'delete', 'cities': cities})
+
+    def edges(self):
+        """
+        :return: The (i, j) pairs with i < j and their distances
+        """
+        pairs = [(city, near_city, dist) for city, near in enumerate(self.neighbours)
+                 for near_city, dist in near.items() if city < near_city]
+        if not pairs:
+            return np.empty((0, 2), dtype=np.intp), np.empty(0)
+        pairs = np.array(pairs)
+        return pairs[:, :2].astype(np.intp), pairs[:, 2]
+
+    def to_csr(self):
+        """
+        :return: The upper triangle graph in the same form as construct_fast_graph
+        """
+        pairs, distances = self.edges()
+        N = len(self.coord_list)
+        return coo_matrix((distances, (pairs[:, 0], pairs[:, 1])), shape=(N, N)).tocsr()
+
+    def _log(self, change):
+        """
+        Appends a change to the delta log if the graph is kept on disk
+        """
+        if self.directory is not None:
+            with open(os.path.join(self.directory, self.DELTA_LOG), 'a') as f:
+                f.write(json.dumps(change) + '\n')
+
+    def save(self, directory=None):
+        """
+        Writes a snapshot of the graph and starts a new, empty delta log
+
+        :param directory: Where to keep the graph, the current directory of the graph if None
+        """
+        self.directory = directory or self.directory
+        os.makedirs(self.directory, exist_ok=True)
+        pairs, distances = self.edges()
+        generation = self.generation + 1
+        snapshot = os.path.join(self.directory, self.SNAPSHOT)
+        _write_atomic(snapshot, lambda f: np.savez(f, coord_list=self.coord_list, active=self.active,
+                                                   radius=self.radius, pairs=pairs, distances=distances,
+                                                   generation=generation))
+        header = json.dumps({'generation': generation}) + '\n'
+        _write_atomic(os.path.join(self.directory, self.DELTA_LOG), lambda f: f.write(header.encode()))
+        self.generation = generation
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Loads the snapshot of the graph and applies the changes logged since it was written
+
+        :param directory: Directory the graph was saved to
+        :return: The graph
+        """
+        graph = cls.__new__(cls)
+        with np.load(os.path.join(directory, cls.SNAPSHOT)) as f:
+            graph._build(f['coord_list'], f['active'], float(f['radius']), f['pairs'], f['distances'])
+            generation = int(f['generation']) if 'generation' in f else 0
+
+        log = os.path.join(directory, cls.DELTA_LOG)
+        stale = False
+        if os.path.exists(log):
+            with open(log) as f:
+                for line in f:
+                    change = json.loads(line)
+                    if 'generation' in change:
+                        stale = change['generation'] != generation
+                        if stale:
+                            break
+                    elif change['op'] == 'insert':
+                        graph.insert(change['coords'])
+                    else:
+                        graph.delete(change['cities'])
+        if stale:
+            # Start the log of this snapshot, which save didn't get to before it was stopped
+            header = json.dumps({'generation': generation}) + '\n'
+            _write_atomic(log, lambda f: f.write(header.encode()))
+        graph.directory = directory
+        graph.generation = generation
+        return graph
+
+
 # The actual code that's run
 if __name__ == "__main__":
 
-    FILENAMES = ['SampleCoordinates.txt', 'HungaryCities.txt', 'GermanyCities.txt']
-    START_NODES = [0, 311, 1573]
-    END_NODES = [5, 702, 10584]
-    RADIUS = [0.08, 0.005, 0.0025]  # All given in the assignment
+    recorder = instrumentation.enable()
 
     # Change the index of all the list files to the correct file number
     # 0 = SampleCoordinates
@@ -266,7 +1826,8 @@ if __name__ == "__main__":
     # 2 = GermanyCoordinates
     coord_list = read_coordinate_file(FILENAMES[0])
 
-    connections, distances = construct_graph_connections(coord_list, RADIUS[0])
+    # Exact reference, construct_graph_connections gives the same but only finishes on small files
+    connections, distances = construct_blocked_graph_connections(coord_list, RADIUS[0])
 
     # Naming these "fast" to keep track on which is which
     connectionsfast, distancesfast = construct_fast_graph_connections(coord_list, RADIUS[0])
@@ -282,4 +1843,6 @@ if __name__ == "__main__":
     plot_points(coord_list, connectionsfast, path_seq)
 
     print("Shortest path from {} and {} is: {}".format(START_NODES[0], END_NODES[0], path_seq))
-    print("And total distance is: {}".format(path[END_NODES[0]]))
\ No newline at end of file
+    print("And total distance is: {}".format(path[END_NODES[0]]))
+
+    recorder.print_summary()
\ No newline at end of file
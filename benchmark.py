@@ -0,0 +1,169 @@
+import argparse
+import json
+import sys
+import numpy as np
+import instrumentation
+from Assignment1 import (FILENAMES, RADIUS, START_NODES, read_coordinate_file, construct_fast_graph_connections,
+                         construct_graph, find_shortest_path)
+
+"""
+Benchmark of the routing pipeline in Assignment1 over the bundled coordinate files and synthetic point clouds
+
+Example:
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json --threshold 0.25
+"""
+
+STAGES = ['read_coordinate_file', 'construct_fast_graph_connections', 'construct_graph', 'find_shortest_path']
+
+# Average number of neighbours of a city in GermanyCities.txt with its radius, used for the synthetic clouds
+SYNTHETIC_DEGREE = 17
+
+
+def synthetic_points(n, seed=0):
+    """
+    Creates n uniformly distributed cities over roughly the area of Germany in projected coordinates
+
+    :param n: Number of cities
+    :param seed: Seed of the random numbers
+    :return: The coordinates and a radius that gives SYNTHETIC_DEGREE neighbours per city on average
+    """
+    rng = np.random.default_rng(seed)
+    low, high = np.array([0.10, 0.95]), np.array([0.26, 1.13])
+    coord_list = low + rng.random((n, 2)) * (high - low)
+    radius = np.sqrt(SYNTHETIC_DEGREE * np.prod(high - low) / (np.pi * n))
+    return coord_list, radius
+
+
+def run_case(load, radius, start, repeats):
+    """
+    Runs the pipeline repeats times while recording the stages, and once more with tracemalloc for the memory
+
+    :param load: Function that returns the coordinates
+    :param radius: The radius which will be checked
+    :param start: The start city
+    :param repeats: Number of timed runs
+    :return: Dict from stage name to its median and p95 time in seconds, peak memory in MB and item counts
+    """
+    def pipeline():
+        coord_list = load()
+        pairs, distances = construct_fast_graph_connections(coord_list, radius)
+        graph = construct_graph(pairs, distances, len(coord_list))
+        find_shortest_path(graph, start)
+
+    recorder = instrumentation.enable()
+    try:
+        for i in range(repeats):
+            pipeline()
+    finally:
+        instrumentation.disable()
+
+    memory_recorder = instrumentation.enable(memory=True)
+    try:
+        pipeline()
+    finally:
+        instrumentation.disable()
+
+    results = {}
+    for name in STAGES:
+        records = [record for record in recorder.records if record['stage'] == name]
+        if not records:
+            continue
+        times = np.array([record['wall_ns'] for record in records]) / 1e9
+        results[name] = {'median_s': float(np.median(times)), 'p95_s': float(np.percentile(times, 95))}
+        for record in memory_recorder.records:
+            if record['stage'] == name:
+                results[name]['peak_mb'] = record['peak_bytes'] / 2**20
+                results[name].update({key: value for key, value in record.items()
+                                      if key not in ('stage', 'wall_ns', 'peak_bytes')})
+    return results
+
+
+def run_benchmark(sizes, repeats, include_files=True):
+    """
+    Benchmarks the bundled files with their radius and synthetic clouds of the given sizes
+
+    :param sizes: Number of cities of the synthetic clouds
+    :param repeats: Number of timed runs per case
+    :param include_files: Also benchmark the bundled coordinate files
+    :return: Dict from case name to the stage results of run_case
+    """
+    cases = {}
+    if include_files:
+        for filename, radius, start in zip(FILENAMES, RADIUS, START_NODES):
+            cases[filename] = run_case(lambda: read_coordinate_file(filename, cache=False), radius, start, repeats)
+            print_case(filename, cases[filename])
+    for n in sizes:
+        coord_list, radius = synthetic_points(n)
+        name = "synthetic-%d" % n
+        cases[name] = run_case(lambda: coord_list, radius, 0, repeats)
+        print_case(name, cases[name])
+    return cases
+
+
+def compare(cases, baseline, threshold, min_seconds=0.001):
+    """
+    Finds the stages whose median time got more than threshold slower than in the baseline
+
+    :param cases: Results from run_benchmark
+    :param baseline: Earlier results from run_benchmark
+    :param threshold: Allowed relative slowdown, 0.2 means 20 %
+    :param min_seconds: Slowdowns smaller than this are timer noise and never regressions
+    :return: A list with one message per regression
+    """
+    regressions = []
+    for case, stages in cases.items():
+        for name, result in stages.items():
+            old = baseline.get(case, {}).get(name)
+            if old is None:
+                continue
+            slowdown = result['median_s'] - old['median_s']
+            if slowdown > old['median_s'] * threshold and slowdown > min_seconds:
+                regressions.append("%s %s: median %.6f s, baseline %.6f s (+%.0f %%)" % (
+                    case, name, result['median_s'], old['median_s'], 100 * (result['median_s'] / old['median_s'] - 1)))
+    return regressions
+
+
+def print_case(case, stages):
+    """
+    Prints the results of one case
+
+    :param case: Name of the case
+    :param stages: The stage results of run_case
+    """
+    print(case)
+    for name, result in stages.items():
+        print("    %-34s median %.6f s  p95 %.6f s  peak %.1f MB" % (
+            name, result['median_s'], result['p95_s'], result.get('peak_mb', float('nan'))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the routing pipeline of Assignment1")
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10000, 100000, 1000000],
+                        help="Number of cities of the synthetic point clouds")
+    parser.add_argument('--repeats', type=int, default=5, help="Timed runs per case")
+    parser.add_argument('--no-files', action='store_true', help="Skip the bundled coordinate files")
+    parser.add_argument('--save', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Baseline JSON file to compare the results with")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed relative slowdown of a stage")
+    parser.add_argument('--min-seconds', type=float, default=0.001, help="Smallest slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    cases = run_benchmark(args.sizes, args.repeats, not args.no_files)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(cases, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(cases, json.load(f), args.threshold, args.min_seconds)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
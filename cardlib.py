@@ -1,4 +1,6 @@
 import random
+from math import comb
+import numpy as np
 from enum import IntEnum
 from abc import ABC, abstractmethod
 from collections import Counter
@@ -348,7 +350,7 @@ class PokerHand:
         :return: HandRanks.Straight_Flush, it's number (10) and a list with the 5 highest cards
         """
         vals = [(c.get_value(), c.suit) for c in cards] + [(1, c.suit) for c in cards if c.get_value == 14]
-        for c in reversed(cards):
+        for c in sorted(cards, reverse=True):  # The highest straight flush first
             found_straight = True
             for k in range(1, 5):
                 if (c.get_value() - k, c.suit) not in vals:
@@ -538,60 +540,44 @@ class PokerHand:
         vals.sort(reverse=True)
         return [vals[0], vals[1], vals[2], vals[3], vals[4]]
 
+    @staticmethod
+    def scan(pokercards):
+        """
+        Ranks the cards by trying the check_* methods from the best pokerhand to the worst
+
+        :param pokercards: The cards to be evaluated
+        :return: The HandRanks and the list with the values of the 5 cards of the pokerhand
+        """
+        pokercards = list(pokercards)
+        checks = [(PokerHand.check_straight_flush, HandRanks.Straight_flush),
+                  (PokerHand.check_fourofakind, HandRanks.Fourofakind),
+                  (PokerHand.check_full_house, HandRanks.Full_house),
+                  (PokerHand.check_flush, HandRanks.Flush),
+                  (PokerHand.check_straight, HandRanks.Straight),
+                  (PokerHand.check_threeofakind, HandRanks.Threeofakind),
+                  (PokerHand.check_twopair, HandRanks.Twopair),
+                  (PokerHand.check_pair, HandRanks.Pair)]
+        for check, ranking in checks:
+            value = check(pokercards)
+            if value is not None:
+                return ranking, value
+        return HandRanks.Highcard, PokerHand.check_highcard(pokercards)
+
     def __init__(self, pokercards):
         super().__init__()
         """
-        Initiating the class,
+        Initiating the class, hands of 5 to 7 cards are ranked with the lookup tables of evaluate
 
         :param pokercards: The cards to be evaluated
         """
-        self.ranking = []
         self.cards = sorted(pokercards)
 
-        if PokerHand.check_straight_flush(pokercards) is not None:
-            value = PokerHand.check_straight_flush(pokercards)
-            self.ranking = HandRanks.Straight_flush
-            self.value = value
-
-        elif PokerHand.check_fourofakind(pokercards) is not None:
-            value = PokerHand.check_fourofakind(pokercards)
-            self.ranking = HandRanks.Fourofakind
-            self.value = value
-
-        elif PokerHand.check_full_house(pokercards) is not None:
-            value = PokerHand.check_full_house(pokercards)
-            self.ranking = HandRanks.Full_house
-            self.value = value
-
-        elif PokerHand.check_flush(pokercards) is not None:
-            value = PokerHand.check_flush(pokercards)
-            self.ranking = HandRanks.Flush
-            self.value = value
-
-        elif PokerHand.check_straight(pokercards) is not None:
-            value = PokerHand.check_straight(pokercards)
-            self.ranking = HandRanks.Straight
-            self.value = value
-
-        elif PokerHand.check_threeofakind(pokercards) is not None:
-            value = PokerHand.check_threeofakind(pokercards)
-            self.ranking = HandRanks.Threeofakind
-            self.value = value
-
-        elif PokerHand.check_twopair(pokercards) is not None:
-            value = PokerHand.check_twopair(pokercards)
-            self.ranking = HandRanks.Twopair
-            self.value = value
-
-        elif PokerHand.check_pair(pokercards) is not None:
-            value = PokerHand.check_pair(pokercards)
-            self.ranking = HandRanks.Pair
-            self.value = value
-
+        if 5 <= len(pokercards) <= 7:
+            self.score = evaluate([card_to_int(card) for card in pokercards])
+            self.ranking, self.value = score_to_hand(self.score)
         else:
-            value = PokerHand.check_highcard(pokercards)
-            self.ranking = HandRanks.Highcard
-            self.value = value
+            self.ranking, self.value = PokerHand.scan(pokercards)
+            self.score = hand_to_score(self.ranking, self.value)
 
     def __str__(self):
         """
@@ -624,6 +610,293 @@ class PokerHand:
         return (self.ranking, self.value) == (other.ranking, other.value)
 
 
+
+def card_to_int(card):
+    """
+    Encodes a card as an integer 0-51, (value - 2) * 4 + suit
+
+    :param card: The PlayingCard
+    :return: The integer of the card
+    """
+    return (card.get_value() - 2) * 4 + int(card.suit)
+
+
+def int_to_card(number):
+    """
+    Decodes an integer from card_to_int back to a PlayingCard
+
+    :param number: The integer of the card
+    :return: The PlayingCard
+    """
+    value, suit = number // 4 + 2, Suit(number % 4)
+    if value <= 10:
+        return NumberedCard(value, suit)
+    return [JackCard, QueenCard, KingCard, AceCard][value - 11](suit)
+
+
+def hand_to_score(ranking, value):
+    """
+    Packs a HandRanks and the 5 values of a pokerhand into one integer, the scores of two hands compare
+    the same way as (ranking, value) does
+
+    :param ranking: The HandRanks
+    :param value: The values of the 5 cards of the pokerhand
+    :return: The score
+    """
+    score = int(ranking)
+    for v in value:
+        score = score << 4 | v
+    return score
+
+
+def score_to_hand(score):
+    """
+    Unpacks a score from hand_to_score
+
+    :param score: The score
+    :return: The HandRanks and the list with the 5 values
+    """
+    return HandRanks(score >> 20), [(score >> shift) & 15 for shift in (16, 12, 8, 4, 0)]
+
+
+def _best_straight(mask):
+    """
+    Finds the highest straight among a set of values, the ace only counts high like in check_straight
+
+    :param mask: Bit value - 2 is set for every value
+    :return: The values of the straight from the highest or None
+    """
+    for high in range(14, 5, -1):
+        straight = 0b11111 << (high - 6)
+        if mask & straight == straight:
+            return [high - k for k in range(5)]
+
+
+def _score_ranks(counts):
+    """
+    Scores a multiset of values the same way as the check_* methods do, without flushes
+
+    :param counts: Number of cards of every value, counts[value]
+    :return: The score
+    """
+    values = [v for v in range(14, 1, -1) if counts[v]]
+    fours = [v for v in values if counts[v] == 4]
+    threes = [v for v in values if counts[v] == 3]
+    pairs = [v for v in values if counts[v] == 2]
+
+    # The cards left after the pokerhand all have different values, except for a third pair
+    if fours:
+        v = fours[0]
+        return hand_to_score(HandRanks.Fourofakind, [v] * 4 + [k for k in values if k != v][:1])
+    if threes and len(threes) + len(pairs) >= 2:
+        two = max(threes[1:] + pairs)
+        return hand_to_score(HandRanks.Full_house, [threes[0]] * 3 + [two] * 2)
+    straight = _best_straight(sum(1 << (v - 2) for v in values))
+    if straight:
+        return hand_to_score(HandRanks.Straight, straight)
+    if threes:
+        v = threes[0]
+        return hand_to_score(HandRanks.Threeofakind, [v] * 3 + [k for k in values if k != v][:2])
+    if len(pairs) >= 2:
+        high, low = pairs[:2]
+        return hand_to_score(HandRanks.Twopair, [high, high, low, low] + [k for k in values if k not in (high, low)][:1])
+    if pairs:
+        v = pairs[0]
+        return hand_to_score(HandRanks.Pair, [v, v] + [k for k in values if k != v][:3])
+    return hand_to_score(HandRanks.Highcard, values[:5])
+
+
+def _score_flush(mask):
+    """
+    Scores the cards of one suit as a straight flush or a flush
+
+    :param mask: Bit value - 2 is set for every value of the suit
+    :return: The score, 0 if there are less than 5 cards
+    """
+    values = [v for v in range(14, 1, -1) if mask >> (v - 2) & 1]
+    if len(values) < 5:
+        return 0
+    straight = _best_straight(mask)
+    if straight:
+        return hand_to_score(HandRanks.Straight_flush, straight)
+    return hand_to_score(HandRanks.Flush, values[:5])
+
+
+class _Tables:
+    """
+    The lookup tables of evaluate, built the first time they are needed
+
+    rank_table maps the sum of 1 << 3 * (value - 2) over the cards (the number of cards of every value) to the
+    score without flushes, for all hands of 5 to 7 cards. flush_table maps the bit mask of the values of
+    one suit to its flush or straight flush score.
+
+    The arrays of evaluate_batch index the hands without flushes by the multisets of their values instead,
+    see _multiset_table, with one array per number of cards.
+    """
+    rank_table = None
+    flush_table = None
+    batch_rank = None
+    batch_flush = None
+    multiset_table = None
+
+    @classmethod
+    def build(cls):
+        cls.flush_table = [_score_flush(mask) for mask in range(1 << 13)]
+        cls.rank_table = {}
+
+        def fill(value, counts, key, size):
+            if value > 14 or size == 7:
+                if size >= 5:
+                    cls.rank_table[key] = _score_ranks(counts)
+                return
+            for n in range(min(4, 7 - size) + 1):
+                counts[value] = n
+                fill(value + 1, counts, key + (n << 3 * (value - 2)), size + n)
+            counts[value] = 0
+
+        fill(2, [0] * 15, 0, 0)
+
+    @classmethod
+    def build_batch(cls):
+        if cls.rank_table is None:
+            cls.build()
+        cls.multiset_table = _multiset_table()
+        cls.batch_flush = np.array(cls.flush_table, dtype=np.int32)
+        cls.batch_rank = {size: np.zeros(comb(12 + size, size), dtype=np.int32) for size in (5, 6, 7)}
+        keys = np.array(list(cls.rank_table), dtype=np.int64)
+        index = _multiset_index(keys)
+        sizes = index & 7
+        index >>= 3
+        scores = np.array(list(cls.rank_table.values()), dtype=np.int32)
+        for size in (5, 6, 7):
+            cls.batch_rank[size][index[sizes == size]] = scores[sizes == size]
+
+
+def _multiset_table():
+    """
+    Ranks the multisets of values in colex order, where the sorted values r_0 <= r_1 <= ... of a multiset
+    (value - 2) get the index sum(comb(r_i + i, i + 1)). The cards of one value add the same to the index
+    whatever comes after them, so the index is a sum over the values, done 4 values at a time.
+
+    :return: Array indexed by group * 32768 + cards of lower values * 4096 + the 12 bits of the rank key of the
+        values 4 * group to 4 * group + 3, with the part of the index from these values shifted up by 3 and
+        their number of cards in the low 3 bits
+    """
+    steps = np.array([[[sum(comb(value + i, i + 1) for i in range(below, below + count)) for count in range(8)]
+                       for below in range(64)] for value in range(13)], dtype=np.int64)
+    field = np.arange(1 << 12)
+    table = np.zeros((4, 8, 1 << 12), dtype=np.int64)
+    for group in range(4):
+        for below in range(8):
+            part = np.zeros(1 << 12, dtype=np.int64)
+            size = np.full(1 << 12, below)
+            for value in range(4 * group, min(4 * group + 4, 13)):
+                count = field >> 3 * (value - 4 * group) & 7
+                part += steps[value, size, count]
+                size += count
+            table[group, below] = part << 3 | (size - below) & 7
+    return table.ravel()
+
+
+# Key of a card in _Tables.rank_table and its bit in a suit mask, indexed by card_to_int
+_RANK_KEY = [1 << 3 * (n // 4) for n in range(52)]
+_RANK_BIT = [1 << (n // 4) for n in range(52)]
+
+# The same as arrays for evaluate_batch, with the suit masks of all suits packed 16 bits per suit
+_BATCH_RANK_KEY = np.array(_RANK_KEY, dtype=np.int64)
+_BATCH_SUIT_BIT = np.array([_RANK_BIT[n] << 16 * (n & 3) for n in range(52)], dtype=np.int64)
+
+
+def evaluate(cards):
+    """
+    Scores the best pokerhand of 5 to 7 cards with two table lookups, a higher score is a better hand and the
+    scores order the hands the same way as PokerHand
+
+    :param cards: The cards encoded with card_to_int
+    :return: The score, see score_to_hand
+    """
+    if _Tables.rank_table is None:
+        _Tables.build()
+    key = 0
+    masks = [0, 0, 0, 0]
+    for card in cards:
+        key += _RANK_KEY[card]
+        masks[card & 3] |= _RANK_BIT[card]
+    score = _Tables.rank_table[key]
+    flush_table = _Tables.flush_table
+    for mask in masks:
+        if flush_table[mask] > score:
+            score = flush_table[mask]
+    return score
+
+
+def _multiset_index(key):
+    """
+    :param key: Array of rank keys, the sums of 1 << 3 * (value - 2) over the cards
+    :return: Array of the colex index of the multisets of values shifted up by 3, plus the number of cards
+    """
+    table = _Tables.multiset_table
+    index = np.zeros(len(key), dtype=np.int64)
+    for group in range(4):
+        index += table[((index & 7) << 12 | key >> 12 * group & 4095) + group * 32768]
+    return index
+
+
+def hand_keys(cards):
+    """
+    Sums up the cards of many hands into the two keys that evaluate_keys scores, the keys of two sets of
+    different cards add up to the keys of all the cards, so the cards that many hands share only have to
+    be summed once
+
+    :param cards: Array of shape (N, k) of cards encoded with card_to_int
+    :return: Arrays of shape (N,) of the rank keys, the sums of 1 << 3 * (value - 2) over the cards, and of
+        the value masks of the suits packed 16 bits per suit
+    """
+    cards = np.asarray(cards, dtype=np.intp)
+    if cards.ndim != 2:
+        raise ValueError("Expected an array of shape (N, k), got {}".format(cards.shape))
+    rank_keys = np.zeros(len(cards), dtype=np.int64)
+    suit_bits = np.zeros(len(cards), dtype=np.int64)
+    for column in np.ascontiguousarray(cards.T):
+        rank_keys += _BATCH_RANK_KEY[column]
+        suit_bits += _BATCH_SUIT_BIT[column]
+    return rank_keys, suit_bits
+
+
+def evaluate_keys(rank_keys, suit_bits, size):
+    """
+    Scores many pokerhands from their keys like evaluate_batch
+
+    :param rank_keys: Array of the rank keys from hand_keys
+    :param suit_bits: Array of the packed suit masks from hand_keys
+    :param size: Number of cards of every hand, 5 to 7
+    :return: Array of the scores
+    """
+    if not 5 <= size <= 7:
+        raise ValueError("Hands have 5 to 7 cards, got {}".format(size))
+    if _Tables.batch_rank is None:
+        _Tables.build_batch()
+    suit_bits = np.asarray(suit_bits)
+    score = _Tables.batch_rank[size][_multiset_index(np.asarray(rank_keys)) >> 3]
+    for suit in range(4):
+        np.maximum(score, _Tables.batch_flush[suit_bits >> 16 * suit & 8191], out=score)
+    return score
+
+
+def evaluate_batch(cards):
+    """
+    Scores many pokerhands at once like evaluate, with array operations over all hands instead of a loop
+
+    :param cards: Array of shape (N, 5), (N, 6) or (N, 7) of cards encoded with card_to_int
+    :return: Array of shape (N,) of the scores
+    """
+    cards = np.asarray(cards, dtype=np.intp)
+    if cards.ndim != 2 or not 5 <= cards.shape[1] <= 7:
+        raise ValueError("Expected an array of shape (N, 5), (N, 6) or (N, 7), got {}".format(cards.shape))
+    rank_keys, suit_bits = hand_keys(cards)
+    return evaluate_keys(rank_keys, suit_bits, cards.shape[1])
+
+
 if __name__ == '__main__':
 
     deck = StandardDeck()
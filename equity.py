@@ -0,0 +1,516 @@
+import os
+import random
+from numbers import Integral
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import combinations, islice, permutations
+from statistics import NormalDist
+import numpy as np
+from cardlib import *
+
+"""
+Equity of Texas Hold'em hands, the chance that each player wins the pot when the rest of the table is dealt
+
+Example:
+    hands = [[AceCard(Suit.Spades), AceCard(Suit.Hearts)], [KingCard(Suit.Clubs), KingCard(Suit.Diamonds)]]
+    print(monte_carlo_equity(hands, samples=200000, seed=1))
+    print(exact_equity(hands))
+    print(parallel_equity(hands, samples=1000000, seed=1, workers=4))
+"""
+
+TABLE_SIZE = 5
+HOLE_SIZE = 2
+
+# Number of tables scored with one call of the batch evaluation, and between two looks at the clock
+BATCH_SIZE = 65536
+
+# Number of exact results kept for repeated queries
+EXACT_CACHE_SIZE = 4096
+
+# The 24 ways to relabel the suits, a card c becomes (c & ~3) | permutation[c & 3]
+SUIT_PERMUTATIONS = list(permutations(range(4)))
+
+
+class Equity:
+    """
+    Counts of won, tied and lost boards for every player, the counts of several runs can be merged. Before
+    any board is counted every fraction is 0 and the intervals are [0, 1]
+    """
+    def __init__(self, players, exact=False):
+        """
+        Initiating the counts with no boards
+
+        :param players: Number of players
+        :param exact: True if every possible board was counted, the intervals then have no width
+        """
+        self.players = players
+        self.exact = exact
+        self.boards = 0
+        self.wins = [0] * players
+        self.ties = [0] * players
+        # Sum of the part of the pot won on every board and the sum of its square, for the intervals
+        self.shares = [0.0] * players
+        self.squares = [0.0] * players
+
+    def add(self, scores, weight=1):
+        """
+        Counts one board
+
+        :param scores: The score of every player on the board, from evaluate
+        :param weight: Number of boards that the board stands for
+        """
+        best = max(scores)
+        self.add_winners([i for i, score in enumerate(scores) if score == best], weight)
+
+    def add_winners(self, winners, weight=1):
+        """
+        Counts boards with the same winners
+
+        :param winners: The players with the best pokerhand, who split the pot if there are more than one
+        :param weight: Number of boards
+        """
+        share = 1 / len(winners)
+        self.boards += weight
+        for i in winners:
+            if len(winners) == 1:
+                self.wins[i] += weight
+            else:
+                self.ties[i] += weight
+            self.shares[i] += share * weight
+            self.squares[i] += share * share * weight
+
+    def merge(self, other):
+        """
+        Adds the counts of another run of the same players
+
+        :param other: The other Equity
+        :return: self
+        """
+        if other.players != self.players:
+            raise ValueError("Can not merge the equity of {} and {} players".format(self.players, other.players))
+        self.boards += other.boards
+        self.exact = self.exact and other.exact
+        for i in range(self.players):
+            self.wins[i] += other.wins[i]
+            self.ties[i] += other.ties[i]
+            self.shares[i] += other.shares[i]
+            self.squares[i] += other.squares[i]
+        return self
+
+    def _fraction(self, count):
+        """
+        :param count: Number of boards
+        :return: count as a fraction of the boards, 0 if there are no boards
+        """
+        return count / self.boards if self.boards else 0.0
+
+    def win(self):
+        """
+        :return: The fraction of the boards won alone by every player
+        """
+        return [self._fraction(w) for w in self.wins]
+
+    def tie(self):
+        """
+        :return: The fraction of the boards where every player split the pot
+        """
+        return [self._fraction(t) for t in self.ties]
+
+    def loss(self):
+        """
+        :return: The fraction of the boards lost by every player
+        """
+        return [self._fraction(self.boards - w - t) for w, t in zip(self.wins, self.ties)]
+
+    def equity(self):
+        """
+        :return: The expected part of the pot of every player, where a split pot counts as a part of a win
+        """
+        return [self._fraction(s) for s in self.shares]
+
+    def interval(self, confidence=0.95):
+        """
+        Normal approximation of the confidence interval of the equity of every player
+
+        :param confidence: Probability that the interval holds the true equity
+        :return: A list with the lower and upper bound of every player
+        """
+        if self.exact:
+            return [(e, e) for e in self.equity()]
+        if not self.boards:
+            return [(0.0, 1.0)] * self.players
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        intervals = []
+        for s, q in zip(self.shares, self.squares):
+            mean = s / self.boards
+            variance = max(q / self.boards - mean * mean, 0) / max(self.boards - 1, 1)
+            half = z * variance ** 0.5
+            intervals.append((max(mean - half, 0), min(mean + half, 1)))
+        return intervals
+
+    def __str__(self):
+        """
+        Layout for printing one line per player
+
+        :return: a nice string layout
+        """
+        lines = []
+        for i, (w, t, l, e, (low, high)) in enumerate(zip(self.win(), self.tie(), self.loss(), self.equity(),
+                                                          self.interval())):
+            lines.append("Player {}: win {:.4f} tie {:.4f} loss {:.4f} equity {:.4f} [{:.4f}, {:.4f}]".format(
+                i + 1, w, t, l, e, low, high))
+        return "\n".join(lines)
+
+
+def _encode(cards):
+    """
+    Encodes the cards of a Hand, a Table or a list of PlayingCards or integers from card_to_int
+
+    :param cards: The cards
+    :return: The list of integers
+    """
+    if cards is None:
+        return []
+    if isinstance(cards, (Hand, Table)):
+        cards = cards.cards
+    return [int(card) if isinstance(card, Integral) else card_to_int(card) for card in cards]
+
+
+def _deal(hands, board):
+    """
+    Encodes and checks the known cards
+
+    :param hands: The hole cards of every player
+    :param board: The cards on the table or None
+    :return: The hole cards, the table cards and the cards left in a StandardDeck, all encoded
+    """
+    holes = [_encode(hand) for hand in hands]
+    board = _encode(board)
+    if len(holes) < 2:
+        raise ValueError("Equity needs at least 2 players")
+    if any(len(hole) != HOLE_SIZE for hole in holes):
+        raise ValueError("Every player needs {} hole cards".format(HOLE_SIZE))
+    if len(board) > TABLE_SIZE:
+        raise ValueError("The table holds at most {} cards".format(TABLE_SIZE))
+    known = [card for hole in holes for card in hole] + board
+    if len(set(known)) != len(known):
+        raise ValueError("The same card is dealt twice")
+    known = set(known)
+    remaining = [card for card in map(card_to_int, StandardDeck().cards) if card not in known]
+    if len(remaining) < TABLE_SIZE - len(board):
+        raise ValueError("Only {} cards are left to deal the table".format(len(remaining)))
+    return holes, board, remaining
+
+
+# The rank key and the packed suit mask of every card from hand_keys, indexed by card_to_int
+_CARD_KEYS, _CARD_BITS = (keys.tolist() for keys in hand_keys(np.arange(52)[:, None]))
+
+# Scale of the weights of _all_tables, divisible by the number of cards of any table
+_WEIGHT_SCALE = 60
+
+
+def _table_state(cards):
+    """
+    :param cards: Encoded cards
+    :return: The sum of the rank keys and the packed suit masks of the cards
+    """
+    return sum(_CARD_KEYS[c] for c in cards), sum(_CARD_BITS[c] for c in cards)
+
+
+def _winners(holes, keys, bits):
+    """
+    Finds the winners of many full tables with evaluate_keys
+
+    :param holes: Encoded hole cards of every player
+    :param keys: Array of the rank keys of the tables
+    :param bits: Array of the packed suit masks of the tables
+    :return: Array of the winners of every table, bit i is set if player i has the best pokerhand
+    """
+    winners = np.zeros(len(keys), dtype=np.int64)
+    best = np.full(len(keys), -1, dtype=np.int32)
+    for i, hole in enumerate(holes):
+        hole_key, hole_bits = _table_state(hole)
+        score = evaluate_keys(keys + hole_key, bits + hole_bits, TABLE_SIZE + HOLE_SIZE)
+        winners[score > best] = 0
+        np.maximum(best, score, out=best)
+        winners[score == best] |= 1 << i
+    return winners
+
+
+def _count(holes, tables):
+    """
+    Finds the winners of every table, BATCH_SIZE tables at a time
+
+    :param holes: Encoded hole cards of every player
+    :param tables: Iterable of the _table_state of every full table and the number of tables it stands for
+    :return: Dict from the winners to their number of tables, bit i of the winners is set if player i has
+        the best pokerhand
+    """
+    outcomes = Counter()
+    tables = iter(tables)
+    while True:
+        batch = np.array(list(islice(tables, BATCH_SIZE)), dtype=np.int64).reshape(-1, 3)
+        if len(batch) == 0:
+            return dict(outcomes)
+        winners = _winners(holes, batch[:, 0], batch[:, 1])
+        values, inverse = np.unique(winners, return_inverse=True)
+        weights = np.zeros(len(values), dtype=np.int64)
+        np.add.at(weights, inverse, batch[:, 2])
+        outcomes.update(dict(zip(values.tolist(), weights.tolist())))
+
+
+def _add_outcomes(equity, outcomes, order=None):
+    """
+    Counts the outcomes of _count in an Equity
+
+    :param equity: The Equity
+    :param outcomes: Dict from the winners to their number of tables
+    :param order: The player of the Equity for every bit of the winners, the same order if None
+    """
+    order = order or range(equity.players)
+    for winners, weight in sorted(outcomes.items()):
+        equity.add_winners([p for i, p in enumerate(order) if winners >> i & 1], weight)
+
+
+def _random_outcomes(holes, board, remaining, boards, generator):
+    """
+    Deals the rest of the table at random and finds the winners with evaluate_keys
+
+    :param holes: Encoded hole cards of every player
+    :param board: Encoded cards on the table
+    :param remaining: Encoded cards that can be dealt
+    :param boards: Number of tables to deal
+    :param generator: The numpy Generator that deals
+    :return: Dict from the winners to their number of tables like _count
+    """
+    # Every card of a table is drawn from the whole deck and the tables that got a card twice are drawn again
+    deck = np.array(remaining, dtype=np.intp)
+    need = TABLE_SIZE - len(board)
+    drawn = generator.integers(0, len(deck), (boards, need))
+    while need > 1:
+        twice = np.zeros(boards, dtype=bool)
+        for i, j in combinations(range(need), 2):
+            twice |= drawn[:, i] == drawn[:, j]
+        if not twice.any():
+            break
+        drawn[twice] = generator.integers(0, len(deck), (int(twice.sum()), need))
+    keys, bits = hand_keys(deck[drawn])
+    board_key, board_bits = _table_state(board)
+    values, counts = np.unique(_winners(holes, keys + board_key, bits + board_bits), return_counts=True)
+    return dict(zip(values.tolist(), counts.tolist()))
+
+
+def _all_tables(holes, board, remaining):
+    """
+    Deals every rest of the table once up to suit isomorphism
+
+    The suit relabellings that keep every hole and the table in place form a group G. Only tables whose lowest
+    card c is the lowest of its orbit under G, and whose other cards all have orbits with no card below c, are
+    dealt. Such a table with t cards from the orbit of c stands for |orbit(c)| / t tables, which adds up to the
+    size of its orbit of tables over all of them.
+
+    :param holes: Encoded hole cards of every player
+    :param board: Encoded cards on the table
+    :param remaining: Encoded cards that can be dealt
+    :return: Generator of the _table_state of the tables and their number of tables times _WEIGHT_SCALE
+    """
+    sets = [set(hole) for hole in holes] + [set(board)]
+    group = [p for p in SUIT_PERMUTATIONS
+             if all({c & ~3 | p[c & 3] for c in cards} == cards for cards in sets)]
+    lowest = [min(c & ~3 | p[c & 3] for p in group) for c in range(52)]
+    orbit_size = Counter(lowest[c] for c in remaining)
+    need = TABLE_SIZE - len(board)
+    board_key, board_bits = _table_state(board)
+    if need == 0:
+        yield board_key, board_bits, _WEIGHT_SCALE
+        return
+
+    for first in remaining:
+        if lowest[first] != first:
+            continue
+        first_key = board_key + _CARD_KEYS[first]
+        first_bits = board_bits + _CARD_BITS[first]
+        weights = [_WEIGHT_SCALE * orbit_size[first] // t for t in range(1, need + 1)]
+        rest = [c for c in remaining if c > first and lowest[c] >= first]
+        same = [lowest[c] == first for c in range(52)]
+        for cards in combinations(rest, need - 1):
+            key, bits, t = first_key, first_bits, 0
+            for c in cards:
+                key += _CARD_KEYS[c]
+                bits += _CARD_BITS[c]
+                t += same[c]
+            yield key, bits, weights[t]
+
+
+def _monte_carlo(holes, board, remaining, samples, seconds, seed):
+    """
+    Deals random tables until the budget is used, also the task of a worker of parallel_equity
+
+    :param holes: Encoded hole cards of every player
+    :param board: Encoded cards on the table
+    :param remaining: Encoded cards that can be dealt
+    :param samples: Number of tables to deal or None
+    :param seconds: Stop dealing after about this many seconds or None
+    :param seed: Seed of the random numbers, anything random.Random takes
+    :return: The Equity
+    """
+    generator = np.random.default_rng(random.Random(seed).getrandbits(128))
+    equity = Equity(len(holes))
+    deadline = None if seconds is None else time.perf_counter() + seconds
+    while samples is None or equity.boards < samples:
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        boards = BATCH_SIZE if samples is None else min(BATCH_SIZE, samples - equity.boards)
+        _add_outcomes(equity, _random_outcomes(holes, board, remaining, boards, generator))
+    return equity
+
+
+def monte_carlo_equity(hands, board=None, samples=None, seconds=None, seed=None):
+    """
+    Estimates the equity of every player by dealing the rest of the table at random many times
+
+    :param hands: The hole cards of 2 or more players, as Hands or lists of PlayingCards
+    :param board: The cards on the table, as a Table or a list of PlayingCards
+    :param samples: Number of tables to deal, 100000 if neither samples nor seconds is given
+    :param seconds: Stop dealing after about this many seconds
+    :param seed: Seed of the random numbers, the same seed and samples give the same result
+    :return: The Equity
+    """
+    holes, board, remaining = _deal(hands, board)
+    if samples is None and seconds is None:
+        samples = 100000
+    return _monte_carlo(holes, board, remaining, samples, seconds, seed)
+
+
+def _canonical(holes, board):
+    """
+    Relabels the suits and sorts the players so that isomorphic deals get the same key
+
+    :param holes: Encoded hole cards of every player
+    :param board: Encoded cards on the table
+    :return: The key, a tuple of the sorted holes and the sorted table, and the player of every hole in the key
+    """
+    best = None
+    for p in SUIT_PERMUTATIONS:
+        relabelled = [tuple(sorted(c & ~3 | p[c & 3] for c in hole)) for hole in holes]
+        order = sorted(range(len(holes)), key=relabelled.__getitem__)
+        key = (tuple(relabelled[i] for i in order), tuple(sorted(c & ~3 | p[c & 3] for c in board)))
+        if best is None or key < best[0]:
+            best = key, order
+    return best
+
+
+@lru_cache(maxsize=EXACT_CACHE_SIZE)
+def _exact_outcomes(key):
+    """
+    Counts the winners of every table for a canonical deal, cached
+
+    :param key: The key from _canonical
+    :return: Tuple of the winners and their number of tables
+    """
+    holes, board = key
+    known = {c for hole in holes for c in hole} | set(board)
+    remaining = [c for c in range(52) if c not in known]
+    outcomes = _count(holes, _all_tables(holes, board, remaining))
+    return tuple((winners, weight // _WEIGHT_SCALE) for winners, weight in outcomes.items())
+
+
+def exact_equity(hands, board=None):
+    """
+    Computes the exact equity of every player by dealing every rest of the table, suit isomorphic tables are
+    only dealt once and the results of the last EXACT_CACHE_SIZE deals are kept for repeated queries
+
+    :param hands: The hole cards of 2 or more players, as Hands or lists of PlayingCards
+    :param board: The cards on the table, as a Table or a list of PlayingCards
+    :return: The Equity, with zero width intervals
+    """
+    holes, board, remaining = _deal(hands, board)
+    key, order = _canonical(holes, board)
+    equity = Equity(len(holes), exact=True)
+    _add_outcomes(equity, dict(_exact_outcomes(key)), order)
+    return equity
+
+
+class _Pool:
+    """
+    The process pool of parallel_equity, kept alive between calls so that the workers only start and build
+    their lookup tables once
+    """
+    executor = None
+    workers = 0
+
+
+def _init_worker():
+    """
+    Builds the lookup tables of evaluate_keys when a worker starts, by scoring no hands
+    """
+    evaluate_batch(np.zeros((0, TABLE_SIZE + HOLE_SIZE), dtype=np.intp))
+
+
+def _pool(workers):
+    """
+    :param workers: Number of processes
+    :return: The ProcessPoolExecutor of parallel_equity, started again if the number of workers changed
+    """
+    if _Pool.executor is None or _Pool.workers != workers:
+        shutdown_pool()
+        _Pool.executor = ProcessPoolExecutor(workers, initializer=_init_worker)
+        _Pool.workers = workers
+    return _Pool.executor
+
+
+def shutdown_pool():
+    """
+    Stops the processes that parallel_equity keeps between calls, the next call starts them again
+    """
+    if _Pool.executor is not None:
+        _Pool.executor.shutdown()
+        _Pool.executor = None
+        _Pool.workers = 0
+
+
+def parallel_equity(hands, board=None, samples=None, seconds=None, seed=None, workers=None):
+    """
+    Estimates the equity like monte_carlo_equity with the tables dealt by a pool of processes
+
+    Every worker gets an equal part of the samples and its own random.Random, seeded with the seed and the
+    number of the worker, and the counts are merged in the order of the workers. The same seed, samples and
+    workers therefore give the same result, while a time budget depends on the speed of the workers. The
+    processes are kept for the next call until shutdown_pool.
+
+    :param hands: The hole cards of 2 or more players, as Hands or lists of PlayingCards
+    :param board: The cards on the table, as a Table or a list of PlayingCards
+    :param samples: Number of tables to deal in total, 100000 if neither samples nor seconds is given
+    :param seconds: Every worker stops dealing after about this many seconds
+    :param seed: Seed of the random numbers, a random seed if None
+    :param workers: Number of processes, all cores if None
+    :return: The Equity
+    """
+    holes, board, remaining = _deal(hands, board)
+    if samples is None and seconds is None:
+        samples = 100000
+    if seed is None:
+        seed = random.getrandbits(64)
+    workers = workers or os.cpu_count() or 1
+    if samples is not None:
+        workers = max(1, min(workers, samples))
+    tasks = []
+    for i in range(workers):
+        part = None if samples is None else samples // workers + (i < samples % workers)
+        tasks.append((holes, board, remaining, part, seconds, "{}:{}".format(seed, i)))
+
+    if workers == 1:
+        results = [_monte_carlo(*tasks[0])]
+    else:
+        try:
+            results = list(_pool(workers).map(_monte_carlo, *zip(*tasks)))
+        except BrokenProcessPool:
+            shutdown_pool()
+            raise
+    equity = Equity(len(holes))
+    for result in results:
+        equity.merge(result)
+    return equity
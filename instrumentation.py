@@ -0,0 +1,197 @@
+import csv
+import functools
+import json
+import sys
+import time
+import tracemalloc
+
+"""
+Timing and memory instrumentation for the stages of the routing pipeline in Assignment1
+"""
+
+# The recorder that collects the stages, None while the instrumentation is disabled
+_recorder = None
+
+
+class StageRecorder:
+    """
+    Collects one record per finished stage with its wall time, peak memory and item counts
+    """
+
+    def __init__(self, memory=False):
+        """
+        Initializing the recorder with no records
+
+        :param memory: Also record the peak memory of every stage with tracemalloc
+        """
+        self.memory = memory
+        self.records = []
+        # True if enable started tracemalloc for this recorder, only then disable stops it
+        self.started_tracing = False
+        # Highest traced memory seen inside the stages that are running, innermost last
+        self._peaks = []
+
+    def _enter(self):
+        """
+        Starts the measurement of a stage
+
+        :return: The state needed by _exit
+        """
+        current = None
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+        return time.perf_counter_ns(), current
+
+    def _exit(self, name, state, counts):
+        """
+        Finishes the measurement of a stage and stores its record
+
+        :param name: Name of the stage
+        :param state: What _enter returned
+        :param counts: Item counts of the stage, e.g. points and edges
+        """
+        start, current = state
+        record = {'stage': name, 'wall_ns': time.perf_counter_ns() - start, 'peak_bytes': None}
+        if self.memory:
+            peak = max(tracemalloc.get_traced_memory()[1], self._peaks.pop())
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            record['peak_bytes'] = peak - current
+        record.update(counts)
+        self.records.append(record)
+
+    def to_json(self, file=None):
+        """
+        Writes the records as a JSON list
+
+        :param file: File name or open text file, the JSON is returned as a string if None
+        :return: The JSON string if file is None
+        """
+        if file is None:
+            return json.dumps(self.records)
+        if isinstance(file, str):
+            with open(file, 'w') as f:
+                json.dump(self.records, f)
+        else:
+            json.dump(self.records, file)
+
+    def to_csv(self, file):
+        """
+        Writes the records as CSV, with one column per count that any of the stages has
+
+        :param file: File name or open text file
+        """
+        columns = ['stage', 'wall_ns', 'peak_bytes']
+        columns += sorted({key for record in self.records for key in record} - set(columns))
+        if isinstance(file, str):
+            with open(file, 'w', newline='') as f:
+                self.to_csv(f)
+            return
+        writer = csv.DictWriter(file, columns)
+        writer.writeheader()
+        writer.writerows(self.records)
+
+    def print_summary(self, file=sys.stdout):
+        """
+        Prints one line per record with the time in seconds
+
+        :param file: Where to print
+        """
+        for record in self.records:
+            extra = " ".join("{}={}".format(key, value) for key, value in record.items()
+                             if key not in ('stage', 'wall_ns', 'peak_bytes'))
+            memory = "" if record['peak_bytes'] is None else " peak %.1f MB" % (record['peak_bytes'] / 2**20)
+            line = "Time of %s  : %.6f%s %s" % (record['stage'], record['wall_ns'] / 1e9, memory, extra)
+            print(line.rstrip(), file=file)
+
+
+def enable(memory=False):
+    """
+    Starts recording the stages in a new recorder, the recorder that was active is disabled first
+
+    :param memory: Also record the peak memory of every stage, this starts tracemalloc which slows down
+        allocations if it isn't running already
+    :return: The recorder
+    """
+    global _recorder
+    disable()
+    recorder = StageRecorder(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        recorder.started_tracing = True
+    _recorder = recorder
+    return _recorder
+
+
+def disable():
+    """
+    Stops recording, the recorder returned by enable keeps its records. tracemalloc is only stopped if
+    enable started it
+
+    :return: The recorder that was active, or None
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None and recorder.started_tracing and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return recorder
+
+
+def stage(name=None, counts=None):
+    """
+    Decorator that records every call of the function as a stage while the instrumentation is enabled
+
+    :param name: Name of the stage, the function name if None
+    :param counts: Function from the return value to a dict of item counts, e.g. {'edges': 10}
+    :return: The decorator
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return func(*args, **kwargs)
+            state = recorder._enter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                recorder._exit(stage_name, state, {'failed': True})
+                raise
+            recorder._exit(stage_name, state, counts(result) if counts else {})
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class measure:
+    """
+    Context manager that records the code inside it as a stage while the instrumentation is enabled
+    """
+
+    def __init__(self, name, **counts):
+        """
+        :param name: Name of the stage
+        :param counts: Item counts of the stage, more can be added to self.counts inside the block
+        """
+        self.name = name
+        self.counts = counts
+        self._recorder = None
+
+    def __enter__(self):
+        self._recorder = _recorder
+        if self._recorder is not None:
+            self._state = self._recorder._enter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._recorder is not None:
+            counts = self.counts if exc_type is None else dict(self.counts, failed=True)
+            self._recorder._exit(self.name, self._state, counts)
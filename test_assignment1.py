@@ -0,0 +1,474 @@
+import pytest
+import csv
+import json
+import os
+import shutil
+import tracemalloc
+import numpy as np
+import benchmark
+from Assignment1 import *
+
+
+def _pairs(links, distances):
+    # Sorts the pairs so that graphs built in a different order can be compared
+    order = np.lexsort((links[:, 1], links[:, 0]))
+    return links[order], distances[order]
+
+
+def _graph(file):
+    coord_list = read_coordinate_file(FILENAMES[file], cache=False)
+    return coord_list, construct_fast_graph(coord_list, RADIUS[file])
+
+
+def _path_length(graph, path_seq):
+    return sum(graph[i, j] for i, j in zip(path_seq[:-1], path_seq[1:]))
+
+
+def test_parse_coordinate_text(tmp_path):
+    filename = str(tmp_path / 'coordinates.txt')
+    with open(filename, 'w') as f:
+        f.write('{55.0, 12.5}\n\n{56.0, 13.5}\n')
+    latlon = np.array([[55.0, 12.5], [56.0, 13.5]])
+    assert np.array_equal(read_coordinate_file(filename, cache=False), mercator_projection(latlon))
+
+    # A missing value on one line and an extra one on another would shift the rows
+    with open(filename, 'w') as f:
+        f.write('{55.0, 12.5}\n{56.0}\n{57.0, 14.5, 1.0}\n')
+    with pytest.raises(ValueError):
+        read_coordinate_file(filename, cache=False)
+    with pytest.raises(ValueError):
+        read_coordinate_file(filename, chunk_lines=2, cache=False)
+
+    with open(filename, 'w') as f:
+        f.write('\n')
+    assert read_coordinate_file(filename, cache=False).shape == (0, 2)
+
+
+def test_read_coordinate_file(tmp_path):
+    filename = str(tmp_path / FILENAMES[1])
+    shutil.copy(FILENAMES[1], filename)
+    parsed = read_coordinate_file(filename, cache=False)
+    assert not parsed.flags.writeable
+    assert parsed.shape == (850, 2)
+
+    first = read_coordinate_file(filename)
+    cached = read_coordinate_file(filename)
+    assert isinstance(cached, np.memmap)
+    assert not first.flags.writeable and not cached.flags.writeable
+    assert np.array_equal(first, parsed) and np.array_equal(cached, parsed)
+    assert np.array_equal(read_coordinate_file(filename, chunk_lines=100, cache=False), parsed)
+
+    # A sidecar of another version of the cache is rebuilt
+    key_file = filename + COORDINATE_CACHE_SUFFIX + '.json'
+    with open(key_file) as f:
+        key = json.load(f)
+    key['version'] = COORDINATE_CACHE_VERSION - 1
+    with open(key_file, 'w') as f:
+        json.dump(key, f)
+    rebuilt = read_coordinate_file(filename)
+    assert not isinstance(rebuilt, np.memmap)
+    assert np.array_equal(rebuilt, parsed)
+    with open(key_file) as f:
+        assert json.load(f)['version'] == COORDINATE_CACHE_VERSION
+
+
+def test_fast_graph_connection_methods():
+    for file in range(len(FILENAMES)):
+        coord_list = read_coordinate_file(FILENAMES[file], cache=False)
+        # Duplicated cities give pairs with zero distance
+        coord_list = np.concatenate((coord_list, coord_list[:5]))
+        links, distances = construct_fast_graph_connections(coord_list, RADIUS[file], method='pairs')
+        assert np.sum(distances == 0) == 10
+        for method in ('sparse', 'loop'):
+            method_links, method_distances = construct_fast_graph_connections(coord_list, RADIUS[file], method=method)
+            assert np.array_equal(method_links, links)
+            assert np.array_equal(method_distances, distances)
+    with pytest.raises(ValueError):
+        construct_fast_graph_connections(coord_list, RADIUS[0], method='unknown')
+
+
+def test_construct_graph():
+    coord_list = read_coordinate_file(FILENAMES[0], cache=False)
+    links, distances = construct_fast_graph_connections(coord_list, RADIUS[0])
+    graph = construct_graph(links, distances, len(coord_list))
+    assert abs(graph - symmetric_graph(construct_fast_graph(coord_list, RADIUS[0]))).max() == pytest.approx(0)
+    # The pair lists are 1-D when no pair is in range
+    for links, distances in (construct_graph_connections(coord_list, 1e-9),
+                             construct_fast_graph_connections(coord_list, 1e-9, method='loop')):
+        graph = construct_graph(links, distances, len(coord_list))
+        assert graph.shape == (len(coord_list), len(coord_list)) and graph.nnz == 0
+
+
+def test_blocked_graph_connections():
+    for file in range(len(FILENAMES)):
+        coord_list = read_coordinate_file(FILENAMES[file], cache=False)
+        links, distances = _pairs(*construct_blocked_graph_connections(coord_list, RADIUS[file], block_mb=1))
+        fast_links, fast_distances = _pairs(*construct_fast_graph_connections(coord_list, RADIUS[file]))
+        assert len(links) > 0
+        assert np.array_equal(links, fast_links)
+        assert np.allclose(distances, fast_distances)
+    small = read_coordinate_file(FILENAMES[0], cache=False)
+    links, distances = _pairs(*construct_graph_connections(small, RADIUS[0]))
+    assert np.array_equal(links, _pairs(*construct_blocked_graph_connections(small, RADIUS[0]))[0])
+
+
+def test_find_route():
+    for file in (1, 2):
+        coord_list, graph = _graph(file)
+        symmetric = symmetric_graph(graph)
+        rng = np.random.default_rng(file)
+        starts = [START_NODES[file]] + rng.integers(0, len(coord_list), 5).tolist()
+        for start in starts:
+            reference, _ = find_shortest_path(graph, start, directed=False)
+            # The first unreachable city, if there is one
+            other = int(np.argmax(np.isinf(reference)))
+            ends = [END_NODES[file], start, other] + rng.integers(0, len(coord_list), 10).tolist()
+            for end in ends:
+                routes = [find_route(graph, coord_list, start, end, directed=False),
+                          find_route(symmetric, coord_list, start, end, max_edge=RADIUS[file])]
+                for distance, path_seq in routes:
+                    if np.isinf(reference[end]):
+                        assert np.isinf(distance) and len(path_seq) == 0
+                    else:
+                        assert distance == pytest.approx(reference[end])
+                        assert path_seq[0] == start and path_seq[-1] == end
+                        assert _path_length(symmetric, path_seq) == pytest.approx(reference[end])
+
+def test_find_route_alt(tmp_path):
+    for file in (1, 2):
+        coord_list, graph = _graph(file)
+        symmetric = symmetric_graph(graph)
+        landmarks, landmark_distances = build_landmarks(symmetric, n_landmarks=8)
+        filename = str(tmp_path / 'landmarks.npz')
+        save_landmarks(filename, landmarks, landmark_distances)
+        loaded_landmarks, loaded_distances = load_landmarks(filename)
+        assert np.array_equal(loaded_landmarks, landmarks) and np.array_equal(loaded_distances, landmark_distances)
+
+        rng = np.random.default_rng(file)
+        # The second start city is outside the component of the landmarks
+        outside = int(np.argmax(np.isinf(landmark_distances[0])))
+        starts = [START_NODES[file], outside] + rng.integers(0, len(coord_list), 5).tolist()
+        for start in starts:
+            reference, _ = find_shortest_path(graph, start, directed=False)
+            other = int(np.argmax(np.isinf(reference)))
+            ends = [END_NODES[file], start, other] + rng.integers(0, len(coord_list), 10).tolist()
+            for end in ends:
+                routes = [find_route_alt(symmetric, landmark_distances, start, end),
+                          find_route_alt(graph, landmark_distances, start, end, coord_list, directed=False)]
+                for distance, path_seq in routes:
+                    if np.isinf(reference[end]):
+                        assert np.isinf(distance) and len(path_seq) == 0
+                    else:
+                        assert distance == pytest.approx(reference[end])
+                        assert path_seq[0] == start and path_seq[-1] == end
+                        assert _path_length(symmetric, path_seq) == pytest.approx(reference[end])
+
+
+def test_route_engine():
+    coord_list, graph = _graph(1)
+    engine = RouteEngine(coord_list, RADIUS[1], batch_sources=3)
+    rng = np.random.default_rng(7)
+    queries = np.column_stack((rng.integers(0, 8, 40), rng.integers(0, len(coord_list), 40)))
+    queries[0] = START_NODES[1], END_NODES[1]
+    # A city of another component can't be reached
+    queries[1, 1] = np.argmax(engine.labels != engine.labels[queries[1, 0]])
+    results = engine.route_many(queries)
+    assert len(results) == len(queries) and engine.queries_per_second > 0
+    for (start, end), (distance, path_seq) in zip(queries, results):
+        reference, _ = find_shortest_path(graph, start, directed=False)
+        if np.isinf(reference[end]):
+            assert np.isinf(distance) and len(path_seq) == 0 and not engine.reachable(start, end)
+        else:
+            assert distance == pytest.approx(reference[end])
+            assert path_seq[0] == start and path_seq[-1] == end
+            assert _path_length(engine.symmetric, path_seq) == pytest.approx(reference[end])
+            distance, path_seq = engine.route(start, end)
+            assert distance == pytest.approx(reference[end])
+
+
+def test_find_shortest_paths_parallel():
+    coord_list, graph = _graph(1)
+    sources = np.array([START_NODES[1], 0, 5, 17, 400, 849])
+    path, predecessor = find_shortest_paths_parallel(graph, sources, directed=False, workers=2, rows_per_task=2)
+    reference, reference_predecessor = shortest_path(graph, directed=False, indices=sources,
+                                                     return_predecessors=True)
+    assert np.array_equal(path, reference)
+    assert np.array_equal(predecessor, reference_predecessor)
+
+
+def test_compute_paths():
+    coord_list, graph = _graph(2)
+    start = START_NODES[2]
+    distances, predecessor = find_shortest_path(graph, start, directed=False)
+    unreachable = np.nonzero(np.isinf(distances))[0]
+    assert len(unreachable) > 0
+    end_nodes = np.concatenate(([start, END_NODES[2]], unreachable[:20],
+                                np.random.default_rng(0).integers(0, len(coord_list), 200)))
+
+    path_flat, offsets, missing = compute_paths(predecessor, start, end_nodes)
+    assert len(offsets) == len(end_nodes) + 1
+    assert np.array_equal(missing, np.isinf(distances[end_nodes]))
+    for k, end in enumerate(end_nodes):
+        path_seq = path_flat[offsets[k]:offsets[k + 1]]
+        if missing[k]:
+            assert len(path_seq) == 0
+            with pytest.raises(ValueError):
+                compute_path(predecessor, start, end)
+        else:
+            assert np.array_equal(path_seq, compute_path(predecessor, start, end))
+
+
+def test_render_points(tmp_path):
+    coord_list = read_coordinate_file(FILENAMES[2], cache=False)
+    links, distances = construct_fast_graph_connections(coord_list, RADIUS[2])
+    upper = links[links[:, 0] < links[:, 1]]
+    assert np.array_equal(decimate_edges(coord_list, links, len(links)), upper)
+
+    kept = decimate_edges(coord_list, links, 2000)
+    assert 0 < len(kept) <= 2000
+    assert np.all(kept[:, 0] < kept[:, 1])
+    # Every kept edge is an edge of the graph and is kept once
+    assert len(np.unique(kept, axis=0)) == len(kept)
+    assert np.all(np.isin(kept[:, 0] * len(coord_list) + kept[:, 1], upper[:, 0] * len(coord_list) + upper[:, 1]))
+
+    # A dense cell next to a sparse one, the dense cell gets all the room the sparse one doesn't need
+    dense = np.random.default_rng(0).random((60, 2)) * 1e-4
+    coords = np.concatenate((dense, [[1.0, 1.0], [1.0, 1.001]]))
+    pairs = np.array([(i, j) for i in range(60) for j in range(i + 1, 60)] + [(60, 61)])
+    kept = decimate_edges(coords, pairs, 1000)
+    assert len(kept) == 1000 and [60, 61] in kept.tolist()
+    assert len(decimate_edges(coords, pairs, 1)) == 1
+
+    filename = str(tmp_path / 'path.png')
+    times = render_points(coord_list, links, [START_NODES[2], END_NODES[2]], filename, max_edges=2000, dpi=50)
+    assert set(times) == {'decimate', 'draw', 'save'}
+    with open(filename, 'rb') as f:
+        assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+
+def test_stage_recorder(tmp_path):
+    recorder = instrumentation.enable(memory=True)
+    try:
+        coord_list = read_coordinate_file(FILENAMES[0], cache=False)
+        with instrumentation.measure('custom', items=3) as measured:
+            measured.counts['more'] = 1
+        with pytest.raises(ZeroDivisionError):
+            with instrumentation.measure('failing'):
+                1 / 0
+    finally:
+        assert instrumentation.disable() is recorder
+    # Nothing is recorded while the instrumentation is disabled
+    read_coordinate_file(FILENAMES[0], cache=False)
+
+    assert [record['stage'] for record in recorder.records] == ['read_coordinate_file', 'custom', 'failing']
+    assert recorder.records[0]['points'] == len(coord_list)
+    assert recorder.records[1]['items'] == 3 and recorder.records[1]['more'] == 1
+    assert recorder.records[2]['failed']
+    assert all(record['wall_ns'] >= 0 and record['peak_bytes'] is not None for record in recorder.records)
+
+    assert json.loads(recorder.to_json()) == recorder.records
+    filename = str(tmp_path / 'stages.json')
+    recorder.to_json(filename)
+    with open(filename) as f:
+        assert json.load(f) == recorder.records
+
+    filename = str(tmp_path / 'stages.csv')
+    recorder.to_csv(filename)
+    with open(filename, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == ['stage', 'wall_ns', 'peak_bytes', 'failed', 'items', 'more', 'points']
+    assert [row['stage'] for row in rows] == ['read_coordinate_file', 'custom', 'failing']
+    assert rows[0]['points'] == str(len(coord_list)) and rows[1]['more'] == '1'
+
+    # tracemalloc is only stopped by disable if enable started it
+    assert not tracemalloc.is_tracing()
+    tracemalloc.start()
+    try:
+        instrumentation.enable(memory=True)
+        instrumentation.disable()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    instrumentation.enable(memory=True)
+    instrumentation.enable(memory=True)
+    assert tracemalloc.is_tracing()
+    instrumentation.disable()
+    assert not tracemalloc.is_tracing()
+
+
+def test_benchmark():
+    cases = benchmark.run_benchmark([500], repeats=2, include_files=False)
+    stages = cases['synthetic-500']
+    # The synthetic clouds aren't read from a file
+    assert list(stages) == benchmark.STAGES[1:]
+    assert stages['construct_graph']['points'] == 500
+    assert stages['construct_fast_graph_connections']['edges'] > 0
+    assert all(result['p95_s'] >= result['median_s'] >= 0 for result in stages.values())
+
+    baseline = {'case': {'fast': {'median_s': 0.1}, 'slow': {'median_s': 0.1}, 'noise': {'median_s': 0.0001}}}
+    cases = {'case': {'fast': {'median_s': 0.11}, 'slow': {'median_s': 0.2}, 'noise': {'median_s': 0.0005},
+                      'new': {'median_s': 1.0}},
+             'other': {'slow': {'median_s': 1.0}}}
+    regressions = benchmark.compare(cases, baseline, threshold=0.2)
+    assert len(regressions) == 1 and regressions[0].startswith('case slow:')
+    assert len(benchmark.compare(cases, baseline, threshold=0.2, min_seconds=0.0001)) == 2
+    assert benchmark.compare(cases, baseline, threshold=1.5) == []
+
+
+def test_dynamic_graph(tmp_path):
+    coord_list = read_coordinate_file(FILENAMES[1], cache=False)
+    radius = RADIUS[1]
+    graph = DynamicGraph(coord_list[:700], radius, directory=str(tmp_path))
+    graph.insert(coord_list[700:800])
+    graph.delete([3, 42, 750])
+    graph.save()
+    graph.insert(coord_list[800:])
+    graph.delete([10, 820])
+
+    # The graph patched by the changes is the graph of the cities that are left
+    keep = np.ones(len(coord_list), dtype=bool)
+    keep[[3, 42, 750, 10, 820]] = False
+    links, distances = construct_fast_graph_connections(coord_list, radius)
+    both = keep[links[:, 0]] & keep[links[:, 1]] & (links[:, 0] < links[:, 1])
+    reference = construct_graph(links[both], distances[both], len(coord_list))
+    assert np.array_equal(graph.active, keep)
+    assert abs(graph.to_csr() - reference).max() == pytest.approx(0)
+
+    # The snapshot and the replayed log give the same graph
+    loaded = DynamicGraph.load(str(tmp_path))
+    assert loaded.generation == graph.generation
+    assert np.array_equal(loaded.active, keep)
+    assert abs(loaded.to_csr() - reference).max() == pytest.approx(0)
+
+    # A log of an older generation is not replayed on top of a newer snapshot
+    loaded.save()
+    with open(os.path.join(str(tmp_path), DynamicGraph.DELTA_LOG), 'w') as f:
+        f.write(json.dumps({'generation': loaded.generation - 1}) + '\n')
+        f.write(json.dumps({'op': 'delete', 'cities': [0]}) + '\n')
+    recovered = DynamicGraph.load(str(tmp_path))
+    assert recovered.active[0]
+    recovered.delete([0])
+    assert not DynamicGraph.load(str(tmp_path)).active[0]
+
+
+def test_radius_sweep():
+    coord_list = read_coordinate_file(FILENAMES[1], cache=False)
+    sweep = RadiusSweep(coord_list, 2 * RADIUS[1])
+    radii = [RADIUS[1] / 2, RADIUS[1], 2 * RADIUS[1]]
+    for radius in radii:
+        graph = construct_fast_graph(coord_list, radius)
+        assert sweep.n_edges(radius) == graph.nnz
+        assert abs(sweep.graph(radius) - graph).max() == pytest.approx(0)
+    with pytest.raises(ValueError):
+        sweep.graph(3 * RADIUS[1])
+
+    results = sweep.sweep(radii, START_NODES[1], END_NODES[1])
+    assert [result['radius'] for result in results] == radii
+    for result in results:
+        graph = construct_fast_graph(coord_list, result['radius'])
+        n_components, labels = connected_components(graph, directed=False)
+        assert result['edges'] == graph.nnz and result['components'] == n_components
+        assert result['largest_component'] == np.bincount(labels).max()
+        reference = shortest_path(graph, directed=False, indices=START_NODES[1])[END_NODES[1]]
+        assert result['path_length'] == pytest.approx(reference)
+
+
+def test_graph_components():
+    coord_list, graph = _graph(2)
+    symmetric = symmetric_graph(graph)
+    labels, sizes = graph_components(graph, directed=False)
+    assert np.array_equal(sizes, np.bincount(labels)) and sizes.sum() == len(coord_list)
+    start = START_NODES[2]
+    reference, predecessor = find_shortest_path(graph, start, directed=False)
+    assert np.array_equal(labels == labels[start], np.isfinite(reference))
+
+    # Cities of other components are rejected without a search
+    other = int(np.argmax(labels != labels[start]))
+    distance, path_seq = find_route(symmetric, coord_list, start, other, labels=labels, max_edge=RADIUS[2])
+    assert np.isinf(distance) and len(path_seq) == 0
+    distance, path_seq = find_route(symmetric, coord_list, start, END_NODES[2], labels=labels, max_edge=RADIUS[2])
+    assert distance == pytest.approx(reference[END_NODES[2]])
+    assert np.array_equal(path_seq, compute_path(predecessor, start, END_NODES[2]))
+
+
+def test_compact_graph():
+    coord_list, graph = _graph(2)
+    compact = construct_fast_graph(coord_list, RADIUS[2], compact=True)
+    assert compact.data.dtype == np.float32
+    assert compact.indices.dtype == np.int32 and compact.indptr.dtype == np.int32
+    assert np.array_equal(compact.indptr, graph.indptr) and np.array_equal(compact.indices, graph.indices)
+    assert np.array_equal(compact.data, graph.data.astype(np.float32))
+
+    links, distances = construct_fast_graph_connections(coord_list, RADIUS[2], compact=True)
+    assert links.dtype == np.int32 and distances.dtype == np.float32
+    full_links, full_distances = construct_fast_graph_connections(coord_list, RADIUS[2])
+    assert np.array_equal(links, full_links) and np.array_equal(distances, full_distances.astype(np.float32))
+    matrix = construct_graph(links, distances, len(coord_list), compact=True)
+    assert matrix.data.dtype == np.float32 and matrix.indices.dtype == np.int32
+
+    error, relative_error = compact_path_error(coord_list, RADIUS[2], [START_NODES[2], 0])
+    assert 0 <= relative_error < 1e-5 and 0 <= error < 1e-5
+
+
+def test_snap_to_cities():
+    coord_list = read_coordinate_file(FILENAMES[1], cache=False)
+    tree = construct_fast_graph_connections(coord_list, RADIUS[1], return_tree=True)[2]
+    with open(FILENAMES[1]) as f:
+        latlon = np.array([[float(value) for value in line.strip('{} \n').split(',')] for line in f])
+    positions = latlon[[START_NODES[1], END_NODES[1], 3]] + np.random.default_rng(3).normal(0, 0.01, (3, 2))
+
+    # The nearest cities found by comparing with all cities
+    projected = mercator_projection(positions)
+    all_distances = np.sqrt(((projected[:, None] - coord_list[None]) ** 2).sum(axis=2))
+    distances, cities = snap_to_cities(tree, positions)
+    assert np.array_equal(cities, np.argmin(all_distances, axis=1))
+    assert np.allclose(distances, all_distances.min(axis=1))
+    distances, cities = snap_to_cities(tree, positions, k=3)
+    assert cities.shape == (3, 3)
+    assert np.array_equal(cities, np.argsort(all_distances, axis=1)[:, :3])
+
+    engine = RouteEngine(coord_list, RADIUS[1])
+    results = engine.route_coordinates(latlon[[START_NODES[1]]], latlon[[END_NODES[1]]])
+    assert len(results) == 1
+    distance, path_seq = results[0]
+    assert path_seq[0] == START_NODES[1] and path_seq[-1] == END_NODES[1]
+    assert distance == pytest.approx(engine.route(START_NODES[1], END_NODES[1])[0])
+
+
+def test_build_graph_out_of_core(tmp_path):
+    directory = str(tmp_path)
+    # A band file left by a run that was stopped
+    np.zeros(3, dtype=np.float64).tofile(os.path.join(directory, 'band_0.bin'))
+    for file in (1, 2):
+        coord_list, graph = _graph(file)
+        matrix = build_graph_out_of_core(FILENAMES[file], RADIUS[file], directory, chunk_lines=1000,
+                                         band_tiles=4)
+        coords, loaded = load_out_of_core_graph(directory)
+        assert np.array_equal(coords, coord_list)
+        assert matrix.nnz == loaded.nnz == graph.nnz
+        assert abs(matrix - graph).max() == pytest.approx(0)
+        assert abs(loaded - graph).max() == pytest.approx(0)
+
+    # No city within radius of another, and no city at all
+    for radius, filename in ((1e-9, FILENAMES[1]), (RADIUS[1], str(tmp_path / 'empty.txt'))):
+        open(str(tmp_path / 'empty.txt'), 'w').close()
+        coord_list = read_coordinate_file(filename, cache=False)
+        matrix = build_graph_out_of_core(filename, radius, directory)
+        coords, loaded = load_out_of_core_graph(directory)
+        assert np.array_equal(coords, coord_list)
+        assert matrix.shape == loaded.shape == (len(coord_list), len(coord_list))
+        assert matrix.nnz == loaded.nnz == construct_fast_graph(coord_list, radius).nnz == 0
+
+
+def test_threaded_graph_connections():
+    for file in range(len(FILENAMES)):
+        coord_list = read_coordinate_file(FILENAMES[file], cache=False)
+        links, distances = construct_fast_graph_connections(coord_list, RADIUS[file], workers=1)
+        graph = construct_fast_graph(coord_list, RADIUS[file], workers=1)
+        for workers in (-1, 3, 16):
+            threaded_links, threaded_distances = construct_fast_graph_connections(coord_list, RADIUS[file],
+                                                                                  workers=workers)
+            assert np.array_equal(threaded_links, links)
+            assert np.array_equal(threaded_distances, distances)
+            threaded = construct_fast_graph(coord_list, RADIUS[file], workers=workers)
+            assert threaded.nnz == graph.nnz and (threaded != graph).nnz == 0
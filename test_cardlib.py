@@ -1,4 +1,5 @@
 import pytest
+import random
 from cardlib import *
 
 
@@ -146,4 +147,46 @@ def test_pokerhand():
     PlayerHand7 = PokerHand(cards_fourofakind)
     PlayerHand8 = PokerHand(cards_straightflush)
 
-    assert PlayerHand2 > PlayerHand1 and PlayerHand4 > PlayerHand3 and PlayerHand6 > PlayerHand5 and PlayerHand8 > PlayerHand7
\ No newline at end of file
+    assert PlayerHand2 > PlayerHand1 and PlayerHand4 > PlayerHand3 and PlayerHand6 > PlayerHand5 and PlayerHand8 > PlayerHand7
+
+def test_evaluate():
+    deck = StandardDeck()
+    for card in deck.cards:
+        assert int_to_card(card_to_int(card)) == card
+
+    cards = [NumberedCard(9, Suit.Hearts), NumberedCard(9, Suit.Clubs), QueenCard(Suit.Spades),
+             QueenCard(Suit.Hearts), QueenCard(Suit.Diamonds), AceCard(Suit.Spades)]
+    assert score_to_hand(evaluate([card_to_int(c) for c in cards])) == (HandRanks.Full_house, [12, 12, 12, 9, 9])
+
+    # Cards from a few values or two suits, so that every kind of pokerhand shows up
+    rng = random.Random(0)
+    for i in range(3000):
+        n = rng.randint(5, 7)
+        values = rng.sample(range(2, 15), rng.randint(3, 7))
+        pool = rng.choice([[c for c in deck.cards if c.get_value() in values],
+                           [c for c in deck.cards if c.suit < 2], deck.cards])
+        if len(pool) < n:
+            continue
+        cards = rng.sample(pool, n)
+        ranking, value = PokerHand.scan(cards)
+        pokerhand = PokerHand(cards)
+        assert (pokerhand.ranking, pokerhand.value) == (ranking, value)
+        assert pokerhand.score == hand_to_score(ranking, value)
+
+
+def test_evaluate_batch():
+    deck = StandardDeck()
+    rng = random.Random(1)
+    for n in (5, 6, 7):
+        hands = [rng.sample(deck.cards, n) for i in range(500)]
+        scores = evaluate_batch([[card_to_int(c) for c in hand] for hand in hands])
+        assert scores.shape == (500,)
+        pokerhands = [PokerHand(hand) for hand in hands]
+        assert scores.tolist() == [pokerhand.score for pokerhand in pokerhands]
+        for i in range(499):
+            first, second = pokerhands[i], pokerhands[i + 1]
+            assert (scores[i] < scores[i + 1]) == (first < second)
+            assert (scores[i] == scores[i + 1]) == (first == second)
+
+    with pytest.raises(ValueError):
+        evaluate_batch([[0, 1, 2, 3]])
@@ -0,0 +1,100 @@
+import pytest
+import random
+import numpy as np
+from equity import *
+
+
+def test_monte_carlo_equity():
+    hands = [[AceCard(Suit.Spades), AceCard(Suit.Hearts)], [KingCard(Suit.Clubs), KingCard(Suit.Diamonds)]]
+    equity = monte_carlo_equity(hands, samples=20000, seed=1)
+    assert equity.boards == 20000
+    assert equity.equity() == monte_carlo_equity(hands, samples=20000, seed=1).equity()
+    low, high = equity.interval()[0]
+    assert 0.78 < low < equity.equity()[0] < high < 0.86
+    for w, t, l in zip(equity.win(), equity.tie(), equity.loss()):
+        assert w + t + l == pytest.approx(1)
+
+    # With the whole table dealt the result is the comparison of the PokerHands
+    rng = random.Random(0)
+    deck = StandardDeck()
+    for i in range(100):
+        players = rng.randint(2, 5)
+        cards = rng.sample(deck.cards, 2 * players + 5)
+        hands, table = [cards[2 * p:2 * p + 2] for p in range(players)], cards[2 * players:]
+        pokerhands = [PokerHand(hand + table) for hand in hands]
+        winners = [p == max(pokerhands) for p in pokerhands]
+        equity = monte_carlo_equity(hands, table, samples=10)
+        assert equity.equity() == [1 / sum(winners) if w else 0 for w in winners]
+
+    with pytest.raises(ValueError):
+        monte_carlo_equity([hands[0], hands[0]])
+
+
+def test_exact_equity():
+    # Every river card of the turn, compared with the PokerHands
+    rng = random.Random(1)
+    deck = StandardDeck()
+    for i in range(20):
+        cards = rng.sample(deck.cards, 8)
+        hands, table = [cards[0:2], cards[2:4]], cards[4:]
+        wins = [0, 0]
+        for card in deck.cards:
+            if card not in cards:
+                first, second = PokerHand(hands[0] + table + [card]), PokerHand(hands[1] + table + [card])
+                wins[0] += second < first
+                wins[1] += first < second
+        equity = exact_equity(hands, table)
+        assert equity.boards == 44 and equity.wins == wins
+        assert equity.interval() == [(e, e) for e in equity.equity()]
+
+    # The suits of the aces and kings can be swapped, so only about half of the tables are dealt
+    hands = [[AceCard(Suit.Spades), AceCard(Suit.Hearts)], [KingCard(Suit.Spades), KingCard(Suit.Hearts)]]
+    table = [NumberedCard(2, Suit.Clubs)]
+    equity = exact_equity(hands, table)
+    assert equity.boards == 178365
+    monte_carlo = monte_carlo_equity(hands, table, samples=20000, seed=2)
+    low, high = monte_carlo.interval(0.999)[0]
+    assert low < equity.equity()[0] < high
+
+    # The same deal with other suits and the players swapped
+    hands = [[KingCard(Suit.Diamonds), KingCard(Suit.Clubs)], [AceCard(Suit.Diamonds), AceCard(Suit.Clubs)]]
+    swapped = exact_equity(hands, [NumberedCard(2, Suit.Hearts)])
+    assert swapped.wins == equity.wins[::-1] and swapped.ties == equity.ties[::-1]
+
+
+def test_parallel_equity():
+    hands = [[AceCard(Suit.Spades), AceCard(Suit.Hearts)], [KingCard(Suit.Clubs), KingCard(Suit.Diamonds)]]
+    table = [NumberedCard(2, Suit.Clubs)]
+    equity = parallel_equity(hands, table, samples=10001, seed=3, workers=2)
+    assert equity.boards == 10001
+    again = parallel_equity(hands, table, samples=10001, seed=3, workers=2)
+    assert (equity.wins, equity.ties, equity.shares) == (again.wins, again.ties, again.shares)
+    low, high = equity.interval(0.999)[0]
+    assert low < exact_equity(hands, table).equity()[0] < high
+    shutdown_pool()
+    restarted = parallel_equity(hands, table, samples=10001, seed=3, workers=2)
+    assert (equity.wins, equity.ties, equity.shares) == (restarted.wins, restarted.ties, restarted.shares)
+    shutdown_pool()
+
+
+def test_equity_edge_cases():
+    hands = [[AceCard(Suit.Spades), AceCard(Suit.Hearts)], [KingCard(Suit.Clubs), KingCard(Suit.Diamonds)]]
+    # Integer cards from card_to_int, also as NumPy integers, give the same deal as the PlayingCards
+    codes = np.array([[card_to_int(card) for card in hand] for hand in hands])
+    assert exact_equity(codes, [NumberedCard(2, Suit.Clubs)]).wins == \
+        exact_equity(hands, [NumberedCard(2, Suit.Clubs)]).wins
+    assert monte_carlo_equity(codes, samples=1000, seed=4).wins == monte_carlo_equity(hands, samples=1000, seed=4).wins
+
+    # No boards dealt in the time budget
+    equity = monte_carlo_equity(hands, seconds=0)
+    assert equity.boards == 0
+    assert equity.win() == equity.tie() == equity.loss() == equity.equity() == [0.0, 0.0]
+    assert equity.interval() == [(0.0, 1.0), (0.0, 1.0)]
+    assert len(str(equity).splitlines()) == 2
+
+    # 24 players leave 4 cards for the 5 cards of the table
+    deck = StandardDeck().cards
+    crowded = [deck[2 * p:2 * p + 2] for p in range(24)]
+    for calculate in (monte_carlo_equity, exact_equity, parallel_equity):
+        with pytest.raises(ValueError):
+            calculate(crowded)